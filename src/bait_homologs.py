@@ -2,24 +2,33 @@
 
 import os
 import sys
+import json
 import argparse
-import newick3
 import logging
 import datetime
+import runner
+from concurrent.futures import as_completed
+from executor import get_executor
 from utils import parse_fasta
-from search_proteomes import search_proteomes
+from search_proteomes import search_proteomes, split_threads
+from cache import cached_stage, evict
+from seqstore import build_store
 from fasta_to_tree import fasta_to_tree
-from trim_tree import trim_tree
-from mask_monophyly import mask_monophyly, get_names_to_exclude
-from cut_internal_branches import cut_internal_branches
+from trim_tree import trim_tree, trim_tree_node
+from mask_monophyly import mask_monophyly, mask_monophyly_node, \
+    get_names_to_exclude
+from cut_internal_branches import cut_internal_branches, \
+    cut_internal_branches_nodes, subtree_names
 from write_fasta_from_tree import write_fasta_from_tree
-from tree_utils import get_front_labels
+from tree_utils import get_front_labels, read_tree, write_tree
 
 
 def check_bait_presence(seqlist, tree):
-    with open(tree, "r") as inf:
-        tre = newick3.parse(inf.readline())
-    taxa = get_front_labels(tre)
+    """Whether any of seqlist is a tip of tree, a newick file or a parsed
+    tree"""
+    if isinstance(tree, str):
+        tree = read_tree(tree)
+    taxa = get_front_labels(tree)
     if set(seqlist).intersection(set(taxa)):
         return True
     else:
@@ -27,15 +36,193 @@ def check_bait_presence(seqlist, tree):
 
 
 def fasta_to_subtree(fa, alner, treblder, relcut, abscut, intcut, mintaxa,
-                     nt, ignore=[], mask=True, para=True, accurate=False):
-    cln, t = fasta_to_tree(fa, nt, alner, treblder, accurate)
-    tt = trim_tree(t, relcut, abscut)
+                     nt, ignore=[], mask=True, para=True, accurate=False,
+                     native_trim=False, aln=None, refine=False,
+                     cache_dir=None, intree=None, final=False,
+                     thresholds=None, keep_trees=False):
+    """Infer a tree from fa, trim and mask it and cut it into subtrees. aln
+    is a previous alignment to take the alignment of fa from, and intree a
+    previous tree to start the tree search from, if any. final and
+    thresholds are for choosing an auto aligner or tree builder. The tree
+    is trimmed, masked and cut in memory, unless keep_trees or cache_dir
+    are given, in which case each step writes its tree and with cache_dir
+    is reused if already run on the same input. Returns a list of (file,
+    tree) of the subtrees, file being where each is or would be written,
+    and the alignment used"""
+    counts = {} if native_trim else None
+    cln, t = fasta_to_tree(fa, nt, alner, treblder, accurate, native_trim,
+                           counts, aln, refine, cache_dir, intree, final,
+                           thresholds)
+    aln = cln[:-len("-cln")]
+    if cache_dir is not None or keep_trees:
+        tt = cached_stage(cache_dir, "trim_tree", [t], [relcut, abscut],
+                          trim_tree, t, relcut, abscut)
+        if mask:
+            tt = cached_stage(cache_dir, "mask_monophyly", [tt, cln],
+                              [para, sorted(ignore)], mask_monophyly, tt,
+                              cln, para, ignore, counts)
+        subtrees = cached_stage(cache_dir, "cut_internal_branches", [tt],
+                                [intcut, mintaxa], cut_internal_branches, tt,
+                                intcut, mintaxa)
+        return [(s, read_tree(s)) for s in subtrees if os.path.isfile(s)], aln
+    tree = trim_tree_node(read_tree(t), relcut, abscut, t)
     if mask:
-        ttmm = mask_monophyly(tt, cln, para, ignore)
-        subtrees = cut_internal_branches(ttmm, intcut, mintaxa)
-    else:
-        subtrees = cut_internal_branches(tt, intcut, mintaxa)
-    return subtrees
+        tree = mask_monophyly_node(tree, cln, para, ignore, counts, t)
+    subtrees = cut_internal_branches_nodes(tree, intcut, mintaxa, t)
+    return list(zip(subtree_names(t, len(subtrees)), subtrees)), aln
+
+
+def process_fasta(fa, hits, baits, store=None, nt=2, alner="mafft",
+                  treblder="fasttree", relcut=1.0, abscut=1.5, intcut=1.0,
+                  mintaxa=4, ignore=[], mask=True, para=True, accurate=False,
+                  native_trim=False, aln=None, refine=False, cache_dir=None,
+                  intree=None, final=False, thresholds=None, keep_trees=False):
+    """Infer subtrees from fa and write the sequences of each subtree
+    containing a bait to a new fasta, removing the other subtrees. Returns
+    the fasta files written, the alignment they were taken from and the
+    subtree each was written from"""
+    subtrees, aln = fasta_to_subtree(fa, alner, treblder, relcut, abscut,
+                                     intcut, mintaxa, nt, ignore, mask, para,
+                                     accurate, native_trim, aln, refine,
+                                     cache_dir, intree, final, thresholds,
+                                     keep_trees)
+    fas = []
+    trees = []
+    for t, tree in subtrees:
+        if check_bait_presence(baits, tree):
+            write_tree(tree, t)
+            newf = write_fasta_from_tree(hits, tree, store, t)
+            logging.info(f"found baits in {t}, writing fasta to {newf}")
+            fas.append(newf)
+            trees.append(os.path.abspath(t))
+        elif os.path.isfile(t):
+            os.remove(t)
+            # comment out this if you want to keep
+    return fas, aln, trees
+
+
+def allot_threads(sizes, nt, jobs):
+    """Split nt threads between inputs of the given sizes run jobs at a
+    time. Each input gets one thread, and the rest of nt in proportion to
+    its size among the largest inputs it could run together with, so inputs
+    running together never use more than nt. Returns the threads of each
+    input"""
+    jobs, _ = split_threads(nt, jobs)
+    spare = max(1, int(nt)) - jobs
+    order = sorted(sizes, key=lambda f: sizes[f], reverse=True)
+    top = sum(sizes[f] for f in order[:jobs])
+    rest = sum(sizes[f] for f in order[:jobs - 1])
+    threads = {}
+    for rank, f in enumerate(order):
+        # the jobs - 1 largest other inputs
+        others = top - sizes[f] if rank < jobs - 1 else rest
+        threads[f] = 1 + spare * sizes[f] // max(1, sizes[f] + others)
+    return threads
+
+
+def process_round(fas, nt=2, jobs=1, alns=None, done=None, finished=None,
+                  starts=None, executor=None, **kwargs):
+    """Run process_fasta on each fasta in fas, returning the fasta files
+    written in the order of fas. With jobs > 1 or a spool:DIR executor
+    (see get_executor), fastas are processed concurrently, largest first,
+    with threads split between them by size. If alns is a dict of fasta:
+    previous alignment, alignments are taken from it instead of
+    realigning, and it is updated with the alignment of each new fasta.
+    Fastas in done, a dict of fasta: result of process_fasta, are not
+    processed again, and finished(fasta, result) is called as each of the
+    others completes. starts is a dict of fasta: tree to start tree
+    searches from, updated like alns"""
+    results = dict(done or {})
+    todo = [f for f in fas if f not in results]
+    jobs = min(int(jobs), len(todo))
+    if executor in (None, "local") and (jobs <= 1 or int(nt) <= 1):
+        for f in todo:
+            results[f] = process_fasta(f, nt=nt, aln=(alns or {}).get(f),
+                                       intree=(starts or {}).get(f),
+                                       **kwargs)
+            if finished is not None:
+                finished(f, results[f])
+        return collect_round(fas, results, alns, starts)
+    sizes = {f: os.path.getsize(f) for f in todo}
+    threads = allot_threads(sizes, nt, jobs)
+    jobs, _ = split_threads(nt, jobs)
+    logging.info(f"processing {len(todo)} fastas, {jobs} at once")
+    with get_executor(executor, jobs) as pool:
+        futures = {pool.submit(process_fasta, f, nt=threads[f],
+                               aln=(alns or {}).get(f),
+                               intree=(starts or {}).get(f), **kwargs): f
+                   for f in sorted(todo, key=lambda x: sizes[x],
+                                   reverse=True)}
+        for fut in as_completed(futures):
+            f = futures[fut]
+            results[f] = fut.result()
+            if finished is not None:
+                finished(f, results[f])
+    return collect_round(fas, results, alns, starts)
+
+
+def collect_round(fas, results, alns=None, starts=None):
+    """Join the fastas written from each of fas, in order, recording the
+    alignment each was taken from in alns and the tree in starts if
+    given"""
+    newfas = []
+    for f in fas:
+        written, aln, trees = results[f]
+        newfas += written
+        if alns is not None:
+            alns.update({newf: aln for newf in written})
+        if starts is not None:
+            starts.update(zip(written, trees))
+    return newfas
+
+
+def load_run_manifest(path):
+    """Read the run manifest at path, or start a new one if there is none"""
+    if path is not None and os.path.isfile(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {"search": None, "rounds": [], "done": False}
+
+
+def save_run_manifest(path, run):
+    """Write the run manifest atomically, so that a run killed while writing
+    leaves the previous manifest in place"""
+    with open(path + ".tmp", "w") as f:
+        json.dump(run, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def checkpointed_round(path, run, rnd, fas, nt=2, jobs=1, alns=None,
+                       starts=None, **kwargs):
+    """Run process_round as round rnd (from 0) of the run manifest at path,
+    recording the output of each fasta as it finishes. Fastas recorded as
+    finished in a previous run of the same round with the same inputs,
+    whose outputs are all present, are not processed again"""
+    if rnd < len(run["rounds"]) and run["rounds"][rnd]["inputs"] == fas:
+        record = run["rounds"][rnd]
+    else:  # new round, or its inputs changed so later rounds are stale
+        del run["rounds"][rnd:]
+        record = {"inputs": fas, "outputs": {}, "done": False}
+        run["rounds"].append(record)
+    done = {f: (out["fastas"], out["aln"],
+                out.get("trees", [None] * len(out["fastas"])))
+            for f, out in record["outputs"].items()
+            if all(os.path.isfile(x) for x in out["fastas"])}
+    if done:
+        print(f"Resuming round {rnd + 1}, {len(done)} of {len(fas)} fastas "
+              "already done")
+        logging.info(f"resuming round {rnd + 1} with {len(done)} of "
+                     f"{len(fas)} fastas done")
+
+    def finished(f, result):
+        record["outputs"][f] = {"fastas": result[0], "aln": result[1],
+                                "trees": result[2]}
+        save_run_manifest(path, run)
+    newfas = process_round(fas, nt, jobs, alns, done, finished, starts,
+                           **kwargs)
+    record["done"] = True
+    save_run_manifest(path, run)
+    return newfas
 
 
 if __name__ == "__main__":
@@ -49,11 +236,46 @@ if __name__ == "__main__":
                         min_bitscore", type=float, default=30.0, metavar='30.0')
     parser.add_argument("--threshold", help="Filter blastp hits with bitscore lower than threshold \
                          * max bitscore of query ", type=float, default=0.1, metavar="0.1")
+    parser.add_argument("--per_query", help="Keep at most this many blastp hits of each query", \
+                        type=int, default=None, metavar="all")
+    parser.add_argument("--max_evalue", help="Filter hmmsearch hits with E-value higher than \
+                        max_evalue", type=float, default=None, metavar="None")
+    parser.add_argument("--min_score", help="Filter hmmsearch hits with bitscore lower than \
+                        min_score", type=float, default=None, metavar="None")
+    parser.add_argument("-pf", "--prefilter", help="Only search sequences sharing at least this \
+                        many reduced-alphabet k-mers with the baits (requires numpy, may miss \
+                        remote homologs)", type=int, default=None, metavar="None")
+    parser.add_argument("--kmer", help="k-mer length for --prefilter", type=int, default=5,
+                        metavar="5")
     parser.add_argument("-a", "--aligner", help="Alignment software to use: mafft, fsa (defaults \
-                        to --fast)", default="mafft", metavar="mafft")
+                        to --fast), or auto to choose mafft L-INS-i, --auto or FFT-NS-2 by \
+                        the number of sequences", default="mafft", metavar="mafft")
     parser.add_argument("-t", "--tree_builder", help="Tree building software to use: fasttree \
-                        (wag), raxml-ng (defaults to WAG+G)", default="fasttree",
-                        metavar="fasttree")
+                        (wag), raxml-ng (defaults to WAG+G), or auto to use raxml-ng for small \
+                        alignments in the final round and fasttree otherwise",
+                        default="fasttree", metavar="fasttree")
+    parser.add_argument("--linsi_seqs", help="With -a auto, use L-INS-i for up to this many \
+                        sequences", type=int, default=200, metavar="200")
+    parser.add_argument("--fftns_seqs", help="With -a auto, use FFT-NS-2 for more than this many \
+                        sequences", type=int, default=2000, metavar="2000")
+    parser.add_argument("--raxml_seqs", help="With -t auto, use raxml-ng in the final round for \
+                        up to this many sequences", type=int, default=100, metavar="100")
+    parser.add_argument("--raxml_cells", help="With -t auto, use raxml-ng in the final round for \
+                        up to this many sequences x alignment columns", type=int,
+                        default=100000, metavar="100000")
+    parser.add_argument("-n", "--native_trim", help="Trim alignment columns in-process (requires \
+                        numpy) instead of with pxclsq", action="store_true")
+    parser.add_argument("-ra", "--reuse_alignment", help="Before the final round, take each \
+                        subtree's alignment from the previous round's alignment instead of \
+                        realigning from scratch", action="store_true")
+    parser.add_argument("--refine", help="With -ra, refine the reused alignment with a single \
+                        cheap mafft pass (FFT-NS-1)", action="store_true")
+    parser.add_argument("-ws", "--warm_start", help="After the first round, start each tree \
+                        search from the previous round's subtree pruned to the alignment",
+                        action="store_true")
+    parser.add_argument("-kt", "--keep_trees", help="Write the trimmed (.tt) and masked (.mm) \
+                        trees of each step instead of passing them on in memory (always done \
+                        with -c)", action="store_true")
     parser.add_argument("-tc", "--tip_abs_cutoff", help="Absolute branch length cutoff for \
                         trimming tips. Tips longer than this will be trimmed", default=1.5,
                         metavar="1.5")
@@ -75,6 +297,26 @@ if __name__ == "__main__":
     parser.add_argument("-mt", "--min_taxa", help="Minimum taxa in a subtree to conserve and check \
                         for bait presence", default=4, metavar="4")
     parser.add_argument("-nt", "--threads", help="Number of threads to use", default=2, metavar="2")
+    parser.add_argument("-sj", "--search_jobs", help="Number of proteomes to search at once, sharing \
+                        --threads between them", type=int, default=1, metavar="1")
+    parser.add_argument("-stj", "--subtree_jobs", help="Number of subtree FASTAs to process at \
+                        once after the first round, sharing --threads between them by size",
+                        type=int, default=1, metavar="1")
+    parser.add_argument("-e", "--executor", help="Where to run concurrent searches and subtree \
+                        jobs: local (default) or spool:DIR to queue them in DIR for executor.py \
+                        workers on any host sharing the filesystem", default=None,
+                        metavar="local")
+    parser.add_argument("-md", "--merged_db", help="Search a single merged DB of all proteomes \
+                        instead of one at a time, applying --keep per taxon", action="store_true")
+    parser.add_argument("-s", "--store", help="Take sequences from an sqlite sequence store of \
+                        database_dir, building or updating it first", action="store_true")
+    parser.add_argument("-sp", "--store_path", help="Path to the sequence store (default \
+                        database_dir/seqstore.sqlite)", default=None)
+    parser.add_argument("-c", "--cache_dir", help="Directory to cache bait HMMs, per-proteome \
+                        hits and the output of each alignment and tree stage in, reused by \
+                        later runs", default=None)
+    parser.add_argument("-cs", "--cache_size", help="Size in GB to trim the cache to", type=float,
+                        default=10.0, metavar="10.0")
     parser.add_argument("-m", "--mask", help="If this flag is selected, monophyletic masking will \
                         be conducted", action="store_true")
     parser.add_argument("-mp", "--mask_paraphyly", help="Whether to mask paraphyletic sequences \
@@ -94,16 +336,41 @@ if __name__ == "__main__":
                         metavar="all")
     parser.add_argument("-dbl", "--dblist", help="Text file with files in database_dir to to \
                         search, if not all, one per line")
+    parser.add_argument("--hits", help="FASTA of hits from an earlier search, such as a \
+                        .hmmsearch.fa written by batch_search.py, to build trees from instead \
+                        of searching database_dir. First round output is written beside it", \
+                        default=None)
+    parser.add_argument("--resume", help="Continue an interrupted run in the current directory \
+                        from its run_manifest.json, skipping the search and subtree FASTAs \
+                        already done", action="store_true")
+    parser.add_argument("--timeout", help="Seconds after which to kill an external program \
+                        (default none)", type=float, default=None, metavar="none")
+    parser.add_argument("--run_stats", help="TSV file to append the wall time, CPU time and peak \
+                        memory of each external program call to", default=None)
     parser.add_argument("bait", help="FASTA file of baits to search")
     parser.add_argument("database_dir", help="Path to the database containing proteomes to search. \
                         Expects file endings of .pep.fa or .cdhit")
     args = parser.parse_args()
 
     logging.basicConfig(filename='log.txt', encoding='utf-8',
-                        level=logging.DEBUG, filemode="w",
+                        level=logging.DEBUG,
+                        filemode="a" if args.resume else "w",
                         format="%(levelname)s|%(message)s")
     logging.info(datetime.datetime.now().strftime("%d.%b %Y %H:%M:%S"))
     logging.info(" ".join([sys.executable] + sys.argv))
+    if args.run_stats is not None:
+        args.run_stats = os.path.abspath(args.run_stats)
+    runner.configure(args.timeout, args.run_stats)
+
+    RUN_MANIFEST = "run_manifest.json"
+    COMMAND = [x for x in sys.argv[1:] if x != "--resume"]
+    RUN = load_run_manifest(RUN_MANIFEST if args.resume else None)
+    if RUN.get("command") not in (None, COMMAND):
+        logging.warning(f"resuming a run started with different options: "
+                        f"{' '.join(RUN['command'])}")
+    RUN["command"] = COMMAND
+    RUN["done"] = False
+    save_run_manifest(RUN_MANIFEST, RUN)
 
     if "/" in args.bait:
         name = args.bait.split("/")[-1].split(".")[0]
@@ -133,78 +400,106 @@ if __name__ == "__main__":
     #         for line in f:
     #             OUTGROUPS.append(line.strip())
 
-    if args.dblist is not None:
-        DBLIST = []
-        with open(args.dblist, "r", encoding="utf-8") as f:
-            for line in f:
-                DBLIST.append(line.strip())
-        hits = search_proteomes(args.bait, args.database_dir, args.output_dir,
-                                args.blast, args.keep, args.threads,
-                                args.min_bitscore, args.threshold, DBLIST)
+    if args.store:
+        STORE = build_store(args.database_dir, args.store_path)
+        logging.info(f"taking sequences from store {STORE}")
+    else:
+        STORE = None
+
+    if args.prefilter is not None:
+        PREFILTER = (args.kmer, args.prefilter)
+        logging.info(f"prefiltering sequences sharing fewer than "
+                     f"{args.prefilter} {args.kmer}-mers with the baits")
+    else:
+        PREFILTER = None
+
+    if RUN["search"] is not None and os.path.isfile(RUN["search"]["hits"]):
+        hits = RUN["search"]["hits"]
+        print(f"Resuming with hits from {hits}")
+        logging.info(f"resuming with hits from {hits}")
+    elif args.hits is not None:
+        hits = os.path.abspath(args.hits)
+        print(f"Taking hits from {hits}")
+        logging.info(f"taking hits from {hits} instead of searching")
+        RUN["search"] = {"hits": hits}
+        save_run_manifest(RUN_MANIFEST, RUN)
     else:
-        hits = search_proteomes(args.bait, args.database_dir, args.output_dir,
-                                args.blast, args.keep, args.threads,
-                                args.min_bitscore, args.threshold)
+        if args.dblist is not None:
+            DBLIST = []
+            with open(args.dblist, "r", encoding="utf-8") as f:
+                for line in f:
+                    DBLIST.append(line.strip())
+            hits = search_proteomes(args.bait, args.database_dir,
+                                    args.output_dir, args.blast, args.keep,
+                                    args.threads, args.min_bitscore,
+                                    args.threshold, DBLIST, args.search_jobs,
+                                    args.merged_db, STORE, args.cache_dir,
+                                    args.cache_size, args.max_evalue,
+                                    args.min_score, args.per_query,
+                                    PREFILTER, args.executor)
+        else:
+            hits = search_proteomes(args.bait, args.database_dir,
+                                    args.output_dir, args.blast, args.keep,
+                                    args.threads, args.min_bitscore,
+                                    args.threshold, jobs=args.search_jobs,
+                                    merged=args.merged_db, store=STORE,
+                                    cache_dir=args.cache_dir,
+                                    cache_size=args.cache_size,
+                                    max_evalue=args.max_evalue,
+                                    min_score=args.min_score,
+                                    per_query=args.per_query,
+                                    prefilter=PREFILTER,
+                                    executor=args.executor)
+        RUN["search"] = {"hits": hits}
+        save_run_manifest(RUN_MANIFEST, RUN)
 
     iters = args.iterate
+    THRESHOLDS = {"linsi_seqs": args.linsi_seqs,
+                  "fftns_seqs": args.fftns_seqs,
+                  "raxml_seqs": args.raxml_seqs,
+                  "raxml_cells": args.raxml_cells}
+    common = {"hits": hits, "baits": BAITS, "store": STORE,
+              "alner": args.aligner, "treblder": args.tree_builder,
+              "mintaxa": args.min_taxa, "ignore": IGNORE, "mask": args.mask,
+              "para": args.mask_paraphyly, "native_trim": args.native_trim,
+              "refine": args.refine, "cache_dir": args.cache_dir,
+              "thresholds": THRESHOLDS, "keep_trees": args.keep_trees}
+    # previous alignment of each fasta, to take the next alignment from
+    ALNS = {} if args.reuse_alignment else None
+    # and the subtree it was written from, to start the tree search from
+    STARTS = {} if args.warm_start else None
     # first round
-    subtrees = fasta_to_subtree(hits, args.aligner, args.tree_builder,
-                                args.tip_rel_cutoff, args.tip_abs_cutoff,
-                                args.internal_cutoff, args.min_taxa,
-                                args.threads, IGNORE, args.mask,
-                                args.mask_paraphyly)
-    fas = []
-    for t in subtrees:
-        if check_bait_presence(BAITS, t):
-            newf = write_fasta_from_tree(hits, t)
-            logging.info(f"found baits in {t}, writing fasta to {newf}")
-            fas.append(newf)
-        else:
-            os.remove(t)
-            # comment out this if you want to keep
+    rnd = 0
+    fas = checkpointed_round(RUN_MANIFEST, RUN, rnd, [hits], args.threads, 1,
+                             ALNS, relcut=args.tip_rel_cutoff,
+                             abscut=args.tip_abs_cutoff,
+                             intcut=args.internal_cutoff,
+                             starts=STARTS, executor=args.executor,
+                             **common)
     iters -= 1  # now 2 in default
     while iters > 0:
-        subtrees = []
+        rnd += 1
         if iters == 1:  # last round, can change
             # to do mafft --genafpair and iqtree
-            for f in fas:
-                subtrees += fasta_to_subtree(f, args.aligner,
-                                             args.tree_builder,
-                                             args.tip_rel_cutoff_final,
-                                             args.tip_abs_cutoff_final,
-                                             args.internal_cutoff_final,
-                                             args.min_taxa,
-                                             args.threads, IGNORE,
-                                             args.mask,
-                                             args.mask_paraphyly,
-                                             accurate=False)
-            for t in subtrees:
-                if check_bait_presence(BAITS, t):
-                    newf = write_fasta_from_tree(hits, t)
-                    logging.info(f"found baits in {t}, writing fasta to {newf}")
-                    fas.append(newf)
-                else:
-                    os.remove(t)
-                    # comment out this if you want to keep
+            # always realigned from scratch
+            fas = checkpointed_round(RUN_MANIFEST, RUN, rnd, fas,
+                                     args.threads, args.subtree_jobs,
+                                     relcut=args.tip_rel_cutoff_final,
+                                     abscut=args.tip_abs_cutoff_final,
+                                     intcut=args.internal_cutoff_final,
+                                     accurate=False, final=True,
+                                     starts=STARTS, executor=args.executor,
+                                     **common)
         else:
-            for f in fas:
-                subtrees += fasta_to_subtree(f, args.aligner,
-                                             args.tree_builder,
-                                             args.tip_rel_cutoff,
-                                             args.tip_abs_cutoff,
-                                             args.internal_cutoff,
-                                             args.min_taxa,
-                                             args.threads, IGNORE,
-                                             args.mask,
-                                             args.mask_paraphyly)
-            fas = []
-            for t in subtrees:
-                if check_bait_presence(BAITS, t):
-                    newf = write_fasta_from_tree(hits, t)
-                    logging.info(f"found baits in {t}, writing fasta to {newf}")
-                    fas.append(newf)
-                else:
-                    os.remove(t)
-                    # comment out this if you want to keep
+            fas = checkpointed_round(RUN_MANIFEST, RUN, rnd, fas,
+                                     args.threads, args.subtree_jobs, ALNS,
+                                     relcut=args.tip_rel_cutoff,
+                                     abscut=args.tip_abs_cutoff,
+                                     intcut=args.internal_cutoff,
+                                     starts=STARTS, executor=args.executor,
+                                     **common)
         iters -= 1
+    evict(args.cache_dir, int(args.cache_size * 1e9))
+    RUN["done"] = True
+    save_run_manifest(RUN_MANIFEST, RUN)
     print("Done!")
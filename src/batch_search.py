@@ -0,0 +1,45 @@
+#! /usr/bin/python3
+
+import sys
+import argparse
+from search_proteomes import search_proteomes_batch
+from seqstore import build_store
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_dir", help="Directory containing sequence \
+                        databases to be searched")
+    parser.add_argument("output_dir", help="Directory to put output")
+    parser.add_argument("baits", help="FASTA files of query sequences, one \
+                        per gene family", nargs="+")
+    parser.add_argument("-k", "--keep", help="Number of hits to retain per \
+                        family (default all)", type=int)
+    parser.add_argument("-t", "--threads", help="Number of threads", type=int,
+                        default=1)
+    parser.add_argument("-dbl", "--dblist", help="Text file with files in \
+                        database_dir to to search, if not all, one per line")
+    parser.add_argument("-s", "--store", help="Take hit sequences from an \
+                        sqlite sequence store of database_dir, building or \
+                        updating it first", action="store_true")
+    parser.add_argument("-sp", "--store_path", help="Path to the sequence \
+                        store (default database_dir/seqstore.sqlite)",
+                        default=None)
+    args = parser.parse_args()
+
+    if args.dblist is not None:
+        DBLIST = []
+        with open(args.dblist, "r") as f:
+            for line in f:
+                DBLIST.append(line.strip())
+    else:
+        DBLIST = None
+    if args.store:
+        STORE = build_store(args.database_dir, args.store_path)
+    else:
+        STORE = None
+    _ = search_proteomes_batch(args.baits, args.database_dir, args.output_dir,
+                               args.keep, args.threads, DBLIST, STORE)
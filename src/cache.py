@@ -0,0 +1,194 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import logging
+import tempfile
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file's content"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digests(paths, cache_dir):
+    """Return a dict of path: digest, reusing digests recorded in
+    cache_dir/checksums.json for files whose size and mtime are
+    unchanged. Runs sharing the cache each write the memo to their own
+    temporary file before moving it into place, and an unreadable memo is
+    treated as empty"""
+    memo = os.path.join(cache_dir, "checksums.json")
+    try:
+        with open(memo, "r") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+    if not isinstance(known, dict):
+        known = {}
+    digests = {}
+    changed = False
+    for path in paths:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        if path in known and known[path][:2] == stamp:
+            digests[path] = known[path][2]
+        else:
+            digests[path] = file_digest(path)
+            known[path] = stamp + [digests[path]]
+            changed = True
+    if changed:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix="checksums.", suffix=".tmp",
+                                   dir=cache_dir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(known, f)
+        os.replace(tmp, memo)
+    return digests
+
+
+def make_key(*parts):
+    """Hash any number of parts (digests, tool names, parameters) into a
+    cache key"""
+    return hashlib.sha256("\0".join(str(p) for p in parts)
+                          .encode()).hexdigest()
+
+
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def cache_get(cache_dir, key, outputs=None):
+    """Copy the files cached under key to outputs, or to the paths they were
+    cached from if outputs is None. Returns the list of paths written, or
+    None if key is not cached"""
+    if cache_dir is None:
+        return None
+    entry = entry_path(cache_dir, key)
+    try:
+        with open(os.path.join(entry, "outputs.json"), "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(cached, dict):
+        cached = cached["paths"]
+    if outputs is None:
+        outputs = cached
+    if len(outputs) != len(cached):
+        return None
+    for i, out in enumerate(outputs):
+        shutil.copyfile(os.path.join(entry, str(i)), out)
+    os.utime(entry)  # mark as recently used
+    return outputs
+
+
+def cache_put(cache_dir, key, outputs, meta=None):
+    """Cache copies of the files in outputs under key, recording any meta
+    dict alongside their paths"""
+    if cache_dir is None:
+        return
+    entry = entry_path(cache_dir, key)
+    if os.path.isdir(entry):
+        os.utime(entry)
+        return
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    for i, out in enumerate(outputs):
+        shutil.copyfile(out, os.path.join(tmp, str(i)))
+    with open(os.path.join(tmp, "outputs.json"), "w") as f:
+        if meta is not None:
+            json.dump(dict(meta, paths=list(outputs)), f)
+        else:
+            json.dump(list(outputs), f)
+    try:
+        os.rename(tmp, entry)
+    except OSError:  # cached by another process in the meantime
+        shutil.rmtree(tmp)
+
+
+def stage_key(stage, inputs, *params):
+    """Cache key of a pipeline stage run on the files in inputs with the
+    given tool and parameters. Input basenames are part of the key as
+    stages name their outputs after their inputs"""
+    return make_key(stage, *[os.path.basename(p) + ":" + file_digest(p)
+                             for p in inputs], *params)
+
+
+def cached_stage(cache_dir, stage, inputs, params, func, *args, **kwargs):
+    """Return func(*args, **kwargs), the path or list of paths of the files
+    a stage wrote next to inputs[0], restoring them from cache_dir instead
+    if the stage has been run on the same inputs with the same params"""
+    if cache_dir is None:
+        return func(*args, **kwargs)
+    key = stage_key(stage, inputs, *params)
+    try:
+        with open(os.path.join(entry_path(cache_dir, key), "outputs.json"),
+                  "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = None
+    if cached is not None:
+        outdir = os.path.dirname(inputs[0])
+        outputs = [os.path.join(outdir, os.path.basename(out))
+                   for out in cached["paths"]]
+        if cache_get(cache_dir, key, outputs) is not None:
+            print(f"Using cached {stage} of {inputs[0]}")
+            logging.info(f"using cached {stage} of {inputs[0]}")
+            return outputs if cached["many"] else outputs[0]
+    result = func(*args, **kwargs)
+    many = not isinstance(result, str)
+    outputs = result if many else [result]
+    if all(os.path.isfile(out) for out in outputs):
+        cache_put(cache_dir, key, outputs, {"many": many})
+    return result
+
+
+def evict(cache_dir, max_bytes):
+    """Remove the least recently used entries from cache_dir until it holds
+    at most max_bytes"""
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return
+    entries = []
+    total = 0
+    for prefix in os.listdir(cache_dir):
+        pdir = os.path.join(cache_dir, prefix)
+        if not os.path.isdir(pdir):
+            continue
+        for key in os.listdir(pdir):
+            entry = os.path.join(pdir, key)
+            size = sum(os.path.getsize(os.path.join(entry, f))
+                       for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+    entries.sort()
+    removed = 0
+    for _, size, entry in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+    if removed > 0:
+        logging.info(f"evicted {removed} cache entries from {cache_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cache_dir", help="Cache directory to trim")
+    parser.add_argument("-cs", "--cache_size", help="Size in GB to trim the \
+                        cache to, removing least recently used entries \
+                        (default 10)", type=float, default=10.0)
+    args = parser.parse_args()
+
+    evict(args.cache_dir, int(args.cache_size * 1e9))
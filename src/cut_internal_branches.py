@@ -3,9 +3,8 @@
 import sys
 import os
 import argparse
-import newick3
 import logging
-from tree_utils import get_front_names, remove_kink
+from tree_utils import get_front_names, remove_kink, read_tree, write_tree
 from shutil import copy
 
 
@@ -44,7 +43,7 @@ def cut_long_internal_branches(curroot, cutoff, mintaxa=4):
                 else:
                     subtrees.append(node)
                 node = node.prune()
-                if len(curroot.leaves()) > 2:  # no kink if only two left
+                if curroot.ntips() > 2:  # no kink if only two left
                     node, curroot = remove_kink(node, curroot)
                     going = True
                 break
@@ -53,41 +52,53 @@ def cut_long_internal_branches(curroot, cutoff, mintaxa=4):
     return subtrees
 
 
-def cut_internal_branches(tre, brlencutoff=1.0, mintaxa=4):
+def cut_internal_branches_nodes(intree, brlencutoff=1.0, mintaxa=4,
+                                name="tree", found=None):
+    """Cut a parsed tree at long internal branches, returning the subtrees
+    with at least mintaxa taxa, largest first. name is the tree's file, for
+    logging. found, if a dict, gets under "cut" the number of subtrees cut
+    before dropping those with too few taxa"""
     mintaxa = int(mintaxa)
     brlencutoff = float(brlencutoff)
     print("Cutting at branches longer than "+str(brlencutoff))
-    logging.info(f"cutting at branches longer than {brlencutoff} in {tre}")
-    subtree_names = []
-    with open(tre, "r") as inf:
-        intree = newick3.parse(inf.readline())
-        subtrees = sorted([x for x in
-                           cut_long_internal_branches(intree, brlencutoff,
-                                                      mintaxa)],
-                          reverse=True, key=lambda x: count_taxa(x))
-        print(subtrees)
-        if len(subtrees) == 0:
-            print("No branches to cut in "+tre)
-            logging.info(f"no branches to cut in {tre}, writing input to "
-                         f"{tre.split('.')[0]}_1.subtree")
-            subtree_names.append(tre.split(".")[0]+"_1.subtree")
-        else:
-            count = 0
-            for t in subtrees:
-                if count_taxa(t) >= mintaxa:
-                    if t.nchildren == 2:  # fix bifurcating roots from cutting
-                        _, t = remove_kink(t, t)
-                    count += 1
-                    sub_name = "".join([tre.split(".")[0],
-                                        "_",
-                                        str(count),
-                                        ".subtree"])
-                    print(sub_name)
-                    subtree_names.append(sub_name)
-                    with open(sub_name, "w") as outfile:
-                        outfile.write(newick3.tostring(t)+";\n")
-    logging.info(f"writing {len(subtree_names)} subtree(s)")
-    return subtree_names
+    logging.info(f"cutting at branches longer than {brlencutoff} in {name}")
+    subtrees = sorted([x for x in
+                       cut_long_internal_branches(intree, brlencutoff,
+                                                  mintaxa)],
+                      reverse=True, key=lambda x: count_taxa(x))
+    print(subtrees)
+    if found is not None:
+        found["cut"] = len(subtrees)
+    kept = []
+    for t in subtrees:
+        if count_taxa(t) >= mintaxa:
+            if t.nchildren == 2:  # fix bifurcating roots from cutting
+                _, t = remove_kink(t, t)
+            kept.append(t)
+    return kept
+
+
+def subtree_names(tre, n):
+    """File names of the n subtrees cut from the tree in tre"""
+    return ["".join([tre.split(".")[0], "_", str(count), ".subtree"])
+            for count in range(1, n + 1)]
+
+
+def cut_internal_branches(tre, brlencutoff=1.0, mintaxa=4):
+    found = {}
+    subtrees = cut_internal_branches_nodes(read_tree(tre), brlencutoff,
+                                           mintaxa, tre, found)
+    if found["cut"] == 0:
+        print("No branches to cut in "+tre)
+        logging.info(f"no branches to cut in {tre}, writing input to "
+                     f"{tre.split('.')[0]}_1.subtree")
+        return subtree_names(tre, 1)
+    names = subtree_names(tre, len(subtrees))
+    for t, sub_name in zip(subtrees, names):
+        print(sub_name)
+        write_tree(t, sub_name)
+    logging.info(f"writing {len(names)} subtree(s)")
+    return names
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+#! /usr/bin/python3
+
+import os
+import abc
+import sys
+import time
+import uuid
+import pickle
+import socket
+import argparse
+import logging
+import importlib
+import threading
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+import runner
+
+
+class Executor(abc.ABC):
+    """Something pipeline stages submit jobs to. submit(func, *args,
+    **kwargs) returns a concurrent.futures.Future of func(*args, **kwargs),
+    and leaving a with block waits for all jobs submitted"""
+    @abc.abstractmethod
+    def submit(self, func, *args, **kwargs):
+        pass
+
+    def shutdown(self, wait=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+        return False
+
+
+class LocalExecutor(Executor):
+    """Run jobs in a pool of worker processes on this host"""
+    def __init__(self, workers=1):
+        self.pool = ProcessPoolExecutor(max_workers=max(1, int(workers)),
+                                        initializer=runner.configure,
+                                        initargs=(runner.TIMEOUT,
+                                                  runner.STATS))
+
+    def submit(self, func, *args, **kwargs):
+        return self.pool.submit(func, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+def spool_dirs(spool):
+    """Create and return the queue, running and done directories of a
+    spool directory"""
+    dirs = [os.path.join(spool, d) for d in ("queue", "running", "done")]
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    return dirs
+
+
+def func_ref(func):
+    """Module and name to import func by in a worker. Functions of the
+    script being run are looked up in it as a module"""
+    module = func.__module__
+    if module == "__main__":
+        module = os.path.basename(sys.modules["__main__"].__file__)[:-3]
+    return module, func.__qualname__
+
+
+class SpoolExecutor(Executor):
+    """Write jobs as files to a spool directory on a filesystem shared with
+    workers (python3 executor.py spool_dir), which can run on any host.
+    Results are collected by polling for the files workers write back"""
+    def __init__(self, spool, poll=1.0):
+        self.spool = os.path.abspath(spool)
+        self.queue, self.running, self.done = spool_dirs(self.spool)
+        self.poll = poll
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.collector = None
+
+    def submit(self, func, *args, **kwargs):
+        # sorts in submission order, for workers to take jobs first in
+        jobid = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+        job = {"func": func_ref(func), "args": args, "kwargs": kwargs,
+               "cwd": os.getcwd(),
+               "path": os.path.dirname(os.path.abspath(__file__)),
+               "timeout": runner.TIMEOUT, "stats": runner.STATS}
+        tmp = os.path.join(self.spool, jobid + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(job, f)
+        fut = Future()
+        with self.lock:
+            self.pending[jobid] = fut
+            # collect clears collector under the lock once nothing is
+            # pending, so a collector that is set will see this job
+            if self.collector is None:
+                self.collector = threading.Thread(target=self.collect,
+                                                  daemon=True)
+                self.collector.start()
+        os.replace(tmp, os.path.join(self.queue, jobid + ".job"))
+        logging.info(f"spooled job {jobid} ({func.__name__})")
+        return fut
+
+    def collect(self):
+        """Poll for results of pending jobs until there are none"""
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.collector = None
+                    return
+                jobids = list(self.pending)
+            for jobid in jobids:
+                res = os.path.join(self.done, jobid + ".result")
+                if not os.path.isfile(res):
+                    continue
+                with open(res, "rb") as f:
+                    status, value = pickle.load(f)
+                os.remove(res)
+                with self.lock:
+                    fut = self.pending.pop(jobid)
+                if status == "ok":
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+            time.sleep(self.poll)
+
+    def shutdown(self, wait=True):
+        while wait:
+            with self.lock:
+                collector = self.collector
+            if collector is None:
+                break
+            collector.join()
+            with self.lock:
+                if self.collector is collector:  # died without clearing it
+                    break
+
+
+def get_executor(spec=None, workers=1):
+    """Executor for spec: local (or None) for a local process pool of
+    workers, or spool:DIR for a spool directory"""
+    if spec is None or spec == "local":
+        return LocalExecutor(workers)
+    if spec.startswith("spool:"):
+        return SpoolExecutor(spec[len("spool:"):])
+    raise ValueError(f"unknown executor {spec}, expected local or "
+                     f"spool:DIR")
+
+
+def claim_job(queue, running):
+    """Move the first job submitted in queue to running, returning its
+    path, or None if there are no jobs. Renaming is atomic, so only one
+    worker gets each job"""
+    for job in sorted(os.listdir(queue)):
+        if not job.endswith(".job"):
+            continue
+        claimed = os.path.join(running, f"{job}.{socket.gethostname()}."
+                                        f"{os.getpid()}")
+        try:
+            os.rename(os.path.join(queue, job), claimed)
+        except OSError:  # taken by another worker
+            continue
+        return claimed
+    return None
+
+
+def run_job(path, done):
+    """Run a claimed job file, writing its result or exception to done"""
+    jobid = os.path.basename(path).split(".")[0]
+    with open(path, "rb") as f:
+        job = pickle.load(f)
+    if job["path"] not in sys.path:
+        sys.path.insert(0, job["path"])
+    runner.configure(job["timeout"], job["stats"])
+    module, name = job["func"]
+    logging.info(f"running job {jobid} ({module}.{name})")
+    here = os.getcwd()
+    try:
+        os.chdir(job["cwd"])
+        func = getattr(importlib.import_module(module), name)
+        result = ("ok", func(*job["args"], **job["kwargs"]))
+    except Exception as e:
+        logging.info(f"job {jobid} failed: {e}")
+        traceback.print_exc()
+        try:
+            pickle.dumps(e)
+            result = ("error", e)
+        except Exception:
+            result = ("error", RuntimeError(traceback.format_exc()))
+    finally:
+        os.chdir(here)
+    tmp = os.path.join(done, jobid + ".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(result, f)
+    os.replace(tmp, os.path.join(done, jobid + ".result"))
+    os.remove(path)
+
+
+def work(spool, poll=1.0, idle=None):
+    """Run jobs from a spool directory until it has had no jobs for idle
+    seconds, or forever if idle is None"""
+    queue, running, done = spool_dirs(os.path.abspath(spool))
+    last = time.monotonic()
+    while idle is None or time.monotonic() - last < idle:
+        path = claim_job(queue, running)
+        if path is None:
+            time.sleep(poll)
+            continue
+        run_job(path, done)
+        last = time.monotonic()
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser(description="Worker for the spool:DIR \
+                                     executor. Start as many as wanted, on \
+                                     any host sharing the spool directory")
+    parser.add_argument("spool", help="Spool directory jobs are written to")
+    parser.add_argument("-n", "--workers", help="Number of worker processes \
+                        to start (default 1)", type=int, default=1)
+    parser.add_argument("--poll", help="Seconds between checks for new jobs \
+                        (default 1)", type=float, default=1.0)
+    parser.add_argument("--idle", help="Exit after this many seconds without \
+                        jobs (default never)", type=float, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s|%(message)s")
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(work, args.spool, args.poll, args.idle)
+                       for _ in range(args.workers)]
+            for fut in futures:
+                fut.result()
+    else:
+        work(args.spool, args.poll, args.idle)
@@ -1,75 +1,240 @@
 #! /usr/bin/python3
 
 import sys
-import subprocess
 import argparse
 import logging
+import runner
+import newick3
+from phylo3 import CompactNode
+from utils import parse_fasta
+from cache import cached_stage
+
+
+# size thresholds for choosing the aligner and tree builder with auto
+AUTO_THRESHOLDS = {
+    "linsi_seqs": 200,  # mafft L-INS-i up to this many sequences
+    "linsi_length": 2000,  # and this mean sequence length
+    "fftns_seqs": 2000,  # mafft FFT-NS-2 above this many, --auto between
+    "raxml_seqs": 100,  # raxml-ng in the final round up to this many
+    "raxml_cells": 100000,  # and this many sequences x columns
+}
+
+
+def fasta_stats(inf):
+    """Number of sequences and mean (ungapped) length of a fasta"""
+    nseq = 0
+    nres = 0
+    for _, seq in parse_fasta(inf):
+        nseq += 1
+        nres += len(seq) - seq.count("-")
+    return nseq, nres / max(nseq, 1)
+
+
+def choose_aligner(inf, thresholds=None):
+    """Choose the mafft strategy for inf by size: L-INS-i for few, short
+    sequences, FFT-NS-2 for many, and mafft --auto between"""
+    t = dict(AUTO_THRESHOLDS, **(thresholds or {}))
+    nseq, length = fasta_stats(inf)
+    if nseq <= t["linsi_seqs"] and length <= t["linsi_length"]:
+        alner = "mafft-linsi"
+    elif nseq > t["fftns_seqs"]:
+        alner = "mafft-fftns2"
+    else:
+        alner = "mafft"
+    print(f"Choosing {alner} for {nseq} sequences of mean length "
+          f"{length:.0f}")
+    logging.info(f"auto: aligning {inf} ({nseq} sequences, mean length "
+                 f"{length:.0f}) with {alner}")
+    return alner
+
+
+def choose_tree_builder(aln, final=False, thresholds=None):
+    """Choose raxml-ng for small alignments in the final round and FastTree
+    otherwise"""
+    t = dict(AUTO_THRESHOLDS, **(thresholds or {}))
+    nseq = 0
+    ncol = 0
+    for _, seq in parse_fasta(aln):
+        nseq += 1
+        ncol = len(seq)
+    if final and nseq <= t["raxml_seqs"] and nseq * ncol <= t["raxml_cells"]:
+        treeblder = "raxml-ng"
+    else:
+        treeblder = "fasttree"
+    print(f"Choosing {treeblder} for {nseq} sequences x {ncol} columns")
+    logging.info(f"auto: inferring tree from {aln} ({nseq} sequences x "
+                 f"{ncol} columns{', final round' if final else ''}) with "
+                 f"{treeblder}")
+    return treeblder
 
 
 def fasta_to_aln(inf, thread=2, alner="mafft", accurate=False):
-    if alner == "mafft":
+    if alner == "mafft-linsi":
+        cmd = ["mafft", "--localpair", "--maxiterate", "1000", "--amino",
+               "--thread", str(thread), inf]
+        out = inf + ".mafftli.aln"
+    elif alner == "mafft-fftns2":
+        cmd = ["mafft", "--retree", "2", "--maxiterate", "0", "--amino",
+               "--thread", str(thread), inf]
+        out = inf + ".mafftfft.aln"
+    elif alner == "mafft":
         if accurate:
             cmd = ["mafft", "--genafpair", "--maxiterate", "1000", "--amino",
                    "--thread", str(thread), inf]
             out = inf + ".mafftgp.aln"
-            outf = open(out, "w")
         else:
             cmd = ["mafft", "--auto", "--amino", "--thread", str(thread), inf]
             out = inf + ".mafft.aln"
-            outf = open(out, "w")
     elif alner == "fsa":
         cmd = ["fsa", "--fast", inf]
         out = inf + ".fsa.aln"
-        outf = open(out, "w")
     print("Aligning sequences with "+alner)
-    print(subprocess.list2cmdline(cmd))
     logging.info(f"aligning sequences in {inf} with {alner}")
-    logging.info(subprocess.list2cmdline(cmd))
-    proc = subprocess.Popen(cmd, shell=False, stdout=outf,
-                            stderr=subprocess.PIPE)
-    while proc.poll() is None:
-        print(proc.stderr.readline().decode().strip())
+    with open(out, "w") as outf:
+        runner.run(cmd, stdout=outf, echo=True)
     return out
 
 
-def clean(aln):
+def subset_alignment(aln, inf, refine=False, thread=2):
+    """Build an alignment of the sequences in inf from a previous alignment
+    aln containing them, taking their rows and dropping columns that are
+    then all gaps. With refine, the subset is realigned with a single
+    cheap mafft pass (FFT-NS-1) instead"""
+    names = [name for name, _ in parse_fasta(inf)]
+    rows = dict(parse_fasta(aln))
+    rows = [rows[name] for name in names]
+    keep = [i for i, col in enumerate(zip(*rows)) if set(col) != {"-"}]
+    out = inf + ".sub.aln"
+    print("Taking alignment of sequences from " + aln)
+    logging.info(f"taking alignment of sequences in {inf} from {aln}")
+    with open(out, "w") as outf:
+        for name, row in zip(names, rows):
+            outf.write(">" + name + "\n")
+            outf.write("".join([row[i] for i in keep]) + "\n")
+    if refine:
+        cmd = ["mafft", "--retree", "1", "--maxiterate", "0", "--amino",
+               "--thread", str(thread), out]
+        refined = inf + ".sub.mafft.aln"
+        print("Refining alignment with mafft")
+        logging.info(f"refining alignment in {out}")
+        with open(refined, "w") as outf:
+            runner.run(cmd, stdout=outf, echo=True)
+        return refined
+    return out
+
+
+def clean(aln, native=False, counts=None):
+    """Remove alignment columns with less than 10% data. With native,
+    trimming is done in-process (requires numpy) instead of with pxclsq,
+    and if counts is a dict it is filled with the number of unambiguous
+    characters of each sequence in the cleaned alignment"""
     cleaned = aln + "-cln"
+    if native:
+        from trim_alignment import trim_alignment  # needs numpy
+        print("Cleaning alignment")
+        logging.info(f"cleaning alignment in {aln} to {cleaned}")
+        chrs = trim_alignment(aln, cleaned, 0.1)
+        if counts is not None:
+            counts.update(chrs)
+        return cleaned
     cmd = ["pxclsq", "-s", aln, "-o", cleaned, "-p", "0.1"]
     print("Cleaning alignment")
-    print(subprocess.list2cmdline(cmd))
     logging.info(f"cleaning alignment in {aln} to {cleaned}")
-    logging.info(subprocess.list2cmdline(cmd))
-    subprocess.run(cmd, shell=False)
+    runner.run(cmd)
     return cleaned
 
 
-def aln_to_tree(aln, treeblder="fasttree", thread=2):
+def collapse_kinks(tree):
+    """Join every node below the root that has a single child, as left by
+    pruning, into its child, summing their branch lengths"""
+    for kink in [n for n in tree.iternodes()
+                 if n.parent is not None and n.nchildren == 1]:
+        child = kink.children[0]
+        if kink.length is not None or child.length is not None:
+            child.length = (kink.length or 0.0) + (child.length or 0.0)
+        par = kink.parent
+        par.remove_child(kink)
+        kink.remove_child(child)
+        par.add_child(child)
+    return tree
+
+
+def prune_start_tree(intree, aln):
+    """Prune the tree in intree to the sequences in aln, writing it to use
+    as a starting tree for aln. Returns its path, or None if the tree does
+    not contain every sequence of aln or has fewer than 3 of them"""
+    names = set(name for name, _ in parse_fasta(aln))
+    with open(intree, "r") as inf:
+        tree = newick3.parse(inf.readline(), node_class=CompactNode)
+    tips = set(n.label for n in tree.leaves())
+    if not names.issubset(tips) or len(names) < 3:
+        logging.info(f"not using {intree} as a starting tree, its tips do "
+                     f"not cover {aln}")
+        return None
+    if tips != names:
+        tree = collapse_kinks(tree.subtree_mapping(names,
+                                                   clean=True)["newroot"])
+    tree.length = None  # no branch above the root
+    out = aln + ".start.tre"
+    with open(out, "w") as outf:
+        outf.write(newick3.tostring(tree) + ";\n")
+    return out
+
+
+def aln_to_tree(aln, treeblder="fasttree", thread=2, start=None):
+    """Infer a tree from aln, starting the search from the tree in start
+    if given"""
     if treeblder == "fasttree":
         out = aln + ".fasttree.tre"
-        cmd = ["fasttree", "-wag", "-out", out, aln]
+        cmd = ["fasttree", "-wag", "-out", out]
+        if start is not None:
+            cmd += ["-intree", start]
+        cmd.append(aln)
     elif treeblder == "raxml-ng":
         # cmd = ["iqtree", "-s", aln, "-m", "WAG+G", "-nt", str(thread)]
         cmd = ["raxml-ng", "--search", "--msa", aln, "--model", "WAG+G",
                "--threads", str(thread)]
+        if start is not None:
+            cmd += ["--tree", start]
     print(f"Inferring tree with {treeblder}")
-    print(subprocess.list2cmdline(cmd))
     logging.info(f"inferring tree from {aln} with {treeblder}")
-    logging.info(subprocess.list2cmdline(cmd))
-    proc = subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE)
-    proc.wait()
+    runner.run(cmd)
     if treeblder == "raxml-ng":
         out = aln + ".raxml.bestTree"
     return out
 
 
 def fasta_to_tree(inf, thread=2, alner="mafft", treeblder="fasttree",
-                  accurate=False):
-    if accurate:
-        aln = fasta_to_aln(inf, thread, alner, accurate)
+                  accurate=False, native_trim=False, counts=None, aln=None,
+                  refine=False, cache_dir=None, intree=None, final=False,
+                  thresholds=None):
+    """Align inf, clean the alignment and infer a tree. If aln is given,
+    the alignment is taken from that previous alignment of a superset of
+    the sequences instead of aligning from scratch. If intree is given, it
+    is pruned to the sequences and used as the starting tree. With
+    cache_dir, each step is reused from the cache if run before on the
+    same input. An alner or treeblder of auto is chosen by size from the
+    thresholds (see AUTO_THRESHOLDS), the tree builder also by whether
+    this is the final round. Returns the cleaned alignment and the tree"""
+    if alner == "auto" and aln is None:
+        alner = "mafft" if accurate else choose_aligner(inf, thresholds)
+    if aln is not None:
+        aln = subset_alignment(aln, inf, refine, thread)
     else:
-        aln = fasta_to_aln(inf, thread, alner)
-    cleaned = clean(aln)
-    out = aln_to_tree(cleaned, treeblder, thread)
+        aln = cached_stage(cache_dir, "align", [inf], [alner, accurate],
+                           fasta_to_aln, inf, thread, alner, accurate)
+    cleaned = cached_stage(cache_dir, "clean", [aln],
+                           ["native" if native_trim else "pxclsq", 0.1],
+                           clean, aln, native_trim, counts)
+    if treeblder == "auto":
+        treeblder = choose_tree_builder(cleaned, final, thresholds)
+    start = None
+    if intree is not None:
+        start = prune_start_tree(intree, cleaned)
+    out = cached_stage(cache_dir, "tree",
+                       [cleaned] + ([start] if start is not None else []),
+                       [treeblder], aln_to_tree, cleaned, treeblder, thread,
+                       start)
     return cleaned, out
 
 
@@ -79,17 +244,28 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-a", "--aligner", help="The software used to infer \
-                        alignments. Options are mafft (auto, default), fsa",
+                        alignments. Options are mafft (auto, default), \
+                        mafft-linsi, mafft-fftns2, fsa, or auto to choose \
+                        the mafft strategy by size",
                         default="mafft")
     parser.add_argument("-t", "--tree_builder", help="The software used to \
-                        infer trees. Options are fasttree (default), iqtree",
+                        infer trees. Options are fasttree (default), \
+                        raxml-ng, or auto (always fasttree outside the \
+                        final round of bait_homologs)",
                         default="fasttree")
     parser.add_argument("-nt", "--threads", help="The number of threads to \
                         use for alignment and tree inference (default 2)",
                         default=2)
+    parser.add_argument("-n", "--native_trim", help="Trim alignment columns \
+                        in-process (requires numpy) instead of with pxclsq",
+                        action="store_true")
+    parser.add_argument("--timeout", help="Seconds after which to kill an \
+                        external program (default none)", type=float,
+                        default=None)
     parser.add_argument("fasta", help="FASTA of sequences to align and infer \
                          a tree")
     args = parser.parse_args()
 
+    runner.configure(args.timeout)
     _, _ = fasta_to_tree(args.fasta, args.threads, args.aligner,
-                         args.tree_builder)
+                         args.tree_builder, native_trim=args.native_trim)
@@ -6,6 +6,7 @@ import re
 import sys
 import argparse
 from utils import parse_fasta
+from seqstore import build_store, get_sequence_dict
 
 
 def get_seqs(q_ids: list, s_seqdict: dict) -> dict:
@@ -29,6 +30,15 @@ if __name__ == "__main__":
     parser.add_argument("sequences", help="FASTA-formatted query sequences")
     parser.add_argument("database_dir", help="Directory containing coding sequence DBs to extract \
                         from. Names should match query IDs")
+    parser.add_argument("-s", "--store", help="Query an sqlite sequence store \
+                        of the .cds.fa files in database_dir, building or \
+                        updating it first, instead of parsing each file",
+                        action="store_true")
+    parser.add_argument("-sp", "--store_path", help="Path to the sequence \
+                        store (default database_dir/seqstore.cds.sqlite). \
+                        Should not be the store of the proteomes, as their \
+                        sequences have the same names",
+                        default=None)
     args = parser.parse_args()
 
     q_dict = dict(parse_fasta(args.sequences))
@@ -36,6 +46,19 @@ if __name__ == "__main__":
     q_taxa = set(x.split("@")[0] for x in q_seq_ids if "@" in x)
     # no "@" is likely bait, so we skip
 
+    if args.store:
+        if args.store_path is None:
+            args.store_path = os.path.join(args.database_dir,
+                                           "seqstore.cds.sqlite")
+        store = build_store(args.database_dir, args.store_path, (".cds.fa",))
+        q_ids = [x for x in q_seq_ids if "@" in x]
+        cds_dict = get_sequence_dict(store, q_ids +
+                                     [re.sub(".p$", "", x) for x in q_ids])
+        for k, v in get_seqs(q_ids, cds_dict).items():
+            print(">" + k)
+            print(v)
+        sys.exit()
+
     db_dict = {}  # key is file, value is path
     for dirpath, _, filenames in os.walk(args.database_dir):
         for f in filenames:
@@ -2,7 +2,7 @@
 
 import sys
 import argparse
-import subprocess
+import runner
 from utils import parse_fasta
 
 
@@ -16,9 +16,9 @@ def get_names_for_tree(inf):
 def run_iqtree(aln, model, nt, bs=1000, alrt=1000):
     """Runs IQ-TREE with the given model string (can also be replaced with MFP
     for model finder). By default does 1000 UFB reps and SH-aLRT"""
-    cmd = ["iqtree", "-s", aln, "-m", model, "-nt", str(nt), "-bb", bs,
-           "-alrt", alrt]
-    subprocess.run(cmd, shell=False)
+    cmd = ["iqtree", "-s", aln, "-m", model, "-nt", str(nt), "-bb", str(bs),
+           "-alrt", str(alrt)]
+    runner.run(cmd)
 
 
 # def convert_names_on_iqtree()
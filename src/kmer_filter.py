@@ -0,0 +1,122 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import tempfile
+import argparse
+import logging
+import numpy as np
+from utils import parse_fasta, fetch_sequences
+
+# Murphy et al. 2000 10-letter reduced amino acid alphabet
+ALPHABET = ["LVIM", "C", "A", "G", "ST", "P", "FYW", "EDNQ", "KR", "H"]
+INVALID = 255
+
+LUT = np.full(256, INVALID, dtype=np.uint8)
+for i, group in enumerate(ALPHABET):
+    for aa in group:
+        LUT[ord(aa)] = i
+        LUT[ord(aa.lower())] = i
+
+
+def kmer_codes(seqs, k=5):
+    """Encode sequences in the reduced alphabet and return, for each
+    sequence, the sorted unique codes of its k-mers as a flat array of
+    codes and an array of per-sequence offsets into it. k-mers containing
+    characters outside the alphabet (X, *, gaps) are skipped"""
+    lengths = np.array([len(s) + 1 for s in seqs], dtype=np.int64)
+    # join with an invalid separator so no k-mer spans two sequences
+    enc = LUT[np.frombuffer("*".join(seqs).encode() + b"*", dtype=np.uint8)]
+    if len(enc) < k:
+        return np.zeros(0, dtype=np.uint32), np.zeros(len(seqs) + 1,
+                                                      dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(enc, k)
+    valid = (windows != INVALID).all(axis=1)
+    weights = (len(ALPHABET) ** np.arange(k - 1, -1, -1)).astype(np.uint64)
+    codes = (windows[valid].astype(np.uint64) * weights).sum(axis=1)
+    starts = np.concatenate([[0], np.cumsum(lengths)])
+    seqids = np.searchsorted(starts, np.nonzero(valid)[0], side="right") - 1
+    # unique (sequence, k-mer) pairs, sorted by sequence then code
+    keys = np.unique(seqids.astype(np.uint64) * np.uint64(
+        len(ALPHABET) ** k) + codes)
+    seqids = keys // np.uint64(len(ALPHABET) ** k)
+    codes = (keys % np.uint64(len(ALPHABET) ** k)).astype(np.uint32)
+    offsets = np.searchsorted(seqids, np.arange(len(seqs) + 1),
+                              side="left").astype(np.int64)
+    return codes, offsets
+
+
+def index_kmers(dbf, k=5):
+    """Build the reduced-alphabet k-mer index of a sequence DB, written to
+    dbf + ".k<k>.npz" with the size and mtime of the DB, through a
+    temporary file so other runs never read a partial index"""
+    names, seqs = [], []  # both empty for an empty DB
+    for name, seq in parse_fasta(dbf):
+        names.append(name)
+        seqs.append(seq)
+    codes, offsets = kmer_codes(seqs, k)
+    st = os.stat(dbf)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(dbf) + ".",
+                               suffix=f".k{k}.npz.tmp",
+                               dir=os.path.dirname(dbf) or ".")
+    try:
+        os.fchmod(fd, 0o644)  # mkstemp makes it private; others read it too
+        with os.fdopen(fd, "wb") as outf:
+            np.savez(outf, codes=codes, offsets=offsets,
+                     names=np.array(names, dtype=str),
+                     stamp=np.array([st.st_size, st.st_mtime_ns]))
+        os.replace(tmp, dbf + f".k{k}.npz")
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return codes, offsets, np.array(names, dtype=str)
+
+
+def load_kmer_index(dbf, k=5):
+    """Return the k-mer index of a sequence DB, rebuilding it if it is
+    missing or the DB has changed"""
+    idx = dbf + f".k{k}.npz"
+    if os.path.isfile(idx):
+        st = os.stat(dbf)
+        with np.load(idx) as npz:
+            if list(npz["stamp"]) == [st.st_size, st.st_mtime_ns]:
+                return npz["codes"], npz["offsets"], npz["names"]
+    return index_kmers(dbf, k)
+
+
+def prefilter(bait, dbf, outf, k=5, min_shared=3):
+    """Write the sequences of dbf sharing at least min_shared reduced
+    alphabet k-mers with the baits to outf. Returns the number of sequences
+    kept and the number in dbf"""
+    codes, offsets, names = load_kmer_index(dbf, k)
+    baitcodes = kmer_codes([s for _, s in parse_fasta(bait)], k)[0]
+    shared = np.concatenate([[0], np.cumsum(np.isin(codes, baitcodes))])
+    counts = shared[offsets[1:]] - shared[offsets[:-1]]
+    keep = names[counts >= min_shared]
+    with open(outf, "w") as f:
+        for name, seq in fetch_sequences(dbf, keep):
+            f.write(">" + name + "\n")
+            f.write(seq + "\n")
+    logging.info(f"k-mer prefilter kept {len(keep)} of {len(names)} "
+                 f"sequences in {dbf}")
+    return len(keep), len(names)
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bait", help="FASTA file of query sequences")
+    parser.add_argument("db", help="Sequence DB to prefilter")
+    parser.add_argument("out", help="FASTA file to write candidates to")
+    parser.add_argument("-k", "--kmer", help="k-mer length (default 5)",
+                        type=int, default=5)
+    parser.add_argument("-m", "--min_shared", help="Minimum k-mers shared \
+                        with the baits to keep a sequence (default 3)",
+                        type=int, default=3)
+    args = parser.parse_args()
+
+    kept, total = prefilter(args.bait, args.db, args.out, args.kmer,
+                            args.min_shared)
+    print(f"kept {kept} of {total} sequences")
@@ -2,9 +2,8 @@
 
 import sys
 import argparse
-import newick3
 import logging
-from tree_utils import get_name, remove_kink
+from tree_utils import get_name, remove_kink, read_tree, write_tree
 from utils import parse_fasta
 
 
@@ -15,7 +14,7 @@ def get_names_to_exclude(ignoref):
 
 def mask_monophyletic_tips(curroot, unamb_chrDICT, ignore=[]):
     going = True
-    while going and curroot is not None and len(curroot.leaves()) >= 4:
+    while going and curroot is not None and curroot.ntips() >= 4:
         going = False
         for node in curroot.iternodes():   # walk through nodes
             if not node.istip:
@@ -29,7 +28,7 @@ def mask_monophyletic_tips(curroot, unamb_chrDICT, ignore=[]):
                         node = sister.prune()
                     else:
                         node = node.prune()
-                    if len(curroot.leaves()) >= 4:
+                    if curroot.ntips() >= 4:
                         if (
                             node == curroot
                             and node.nchildren == 2
@@ -44,7 +43,7 @@ def mask_monophyletic_tips(curroot, unamb_chrDICT, ignore=[]):
 
 def mask_paraphyletic_tips(curroot, unamb_chrDICT, ignore=[]):
     going = True
-    while going and curroot is not None and len(curroot.leaves()) >= 4:
+    while going and curroot is not None and curroot.ntips() >= 4:
         going = False
         for node in curroot.iternodes():  # walk through nodes
             if not node.istip:
@@ -61,7 +60,7 @@ def mask_paraphyletic_tips(curroot, unamb_chrDICT, ignore=[]):
                         node = para.prune()
                     else:
                         node = node.prune()
-                    if len(curroot.leaves()) >= 4:
+                    if curroot.ntips() >= 4:
                         if (
                             node == curroot
                             and node.nchildren == 2
@@ -74,32 +73,45 @@ def mask_paraphyletic_tips(curroot, unamb_chrDICT, ignore=[]):
     return curroot
 
 
-def mask(curroot, clnfile, para=True, ignore=[]):
-    chrDICT = {}  # key is seqid, value is number of unambiguous chrs
-    for key, value in dict([x for x in parse_fasta(clnfile)]).items():
-        for ch in ['-', 'X', "x", "?", "*"]:
-            value = value.replace(ch, "")  # ignore gaps, xs and Xs
-        chrDICT[key] = len(value)
+def mask(curroot, clnfile, para=True, ignore=[], counts=None):
+    """Mask tips of curroot, keeping the sequence with the most unambiguous
+    characters in the cleaned alignment. These are counted from clnfile
+    unless already given as counts"""
+    if counts:
+        chrDICT = counts
+    else:
+        chrDICT = {}  # key is seqid, value is number of unambiguous chrs
+        for key, value in dict([x for x in parse_fasta(clnfile)]).items():
+            for ch in ['-', 'X', "x", "?", "*"]:
+                value = value.replace(ch, "")  # ignore gaps, xs and Xs
+            chrDICT[key] = len(value)
     curroot = mask_monophyletic_tips(curroot, chrDICT, ignore)
     if para:
         curroot = mask_paraphyletic_tips(curroot, chrDICT, ignore)
     return curroot
 
 
-def mask_monophyly(tre, clnaln, para=True, ignore=[]):
-    with open(tre, "r") as inf:
-        intree = newick3.parse(inf.readline())
-    in_tips = len(intree.leaves())
-    curroot = mask(intree, clnaln, para, ignore)
-    out_tips = len(curroot.leaves())
-    masked = tre + ".mm"
+def mask_monophyly_node(intree, clnaln, para=True, ignore=[], counts=None,
+                        name="tree"):
+    """Mask tips of a parsed tree in place, returning its root. name is the
+    tree's file, for logging"""
+    in_tips = intree.ntips()
+    curroot = mask(intree, clnaln, para, ignore, counts)
+    out_tips = curroot.ntips()
     if para:
-        logging.info(f"masking monophyletic and paraphyletic tips in {tre}")
+        logging.info(f"masking monophyletic and paraphyletic tips in {name}")
     else:
-        logging.info(f"masking monophyletic tips in {tre}")
-    logging.info(f"masked {in_tips - out_tips} tips, writing to {masked}")
-    with open(masked, "w") as outf:
-        outf.write(newick3.tostring(curroot)+";\n")
+        logging.info(f"masking monophyletic tips in {name}")
+    logging.info(f"masked {in_tips - out_tips} tips")
+    return curroot
+
+
+def mask_monophyly(tre, clnaln, para=True, ignore=[], counts=None):
+    curroot = mask_monophyly_node(read_tree(tre), clnaln, para, ignore,
+                                  counts, tre)
+    masked = tre + ".mm"
+    logging.info(f"writing to {masked}")
+    write_tree(curroot, masked)
     return masked
 
 
@@ -26,11 +26,12 @@ class Tokenizer(shlex):
                 pass
 
 
-def parse(input, ttable=None):
+def parse(input, ttable=None, node_class=Node):
     """
     Parse a Newick-formatted tree description
     input is any file-like object that can be coerced into shlex,
     or a string (converted to StringIO)
+    nodes are created as node_class, e.g. phylo3.CompactNode for large trees
     """
     if type(input) is str:
         try:
@@ -60,7 +61,7 @@ def parse(input, ttable=None):
         # internal node
         elif token == '(':
             lp = lp+1
-            newnode = Node()
+            newnode = node_class()
             newnode.istip = False
             if node:
                 node.add_child(newnode)
@@ -100,7 +101,7 @@ def parse(input, ttable=None):
                     ttoken = ttable.get(token) or ttable.get(int(token))
                     if ttoken:
                         token = ttoken
-                newnode = Node()
+                newnode = node_class()
                 newnode.label = token
                 newnode.istip = True
                 node.add_child(newnode)
@@ -125,37 +126,43 @@ def traverse(node):
 
 
 def to_string(node, length_fmt=":%s"):
-    if not node.istip:
-        node_str = "(%s)%s" % \
-                   (",".join([to_string(child, length_fmt)
-                              for child in node.children]),
-                    node.label or ""
-                    )
-    else:
-        node_str = "%s" % node.label
-
-    if node.length is not None:
-        length_str = length_fmt % node.length
-        # length_str = ':%f' % node.length
-        # length_str = str(length_str)
-    else:
-        length_str = ""
-
-    s = "%s%s" % (node_str, length_str)
-    return s
+    # written out in pieces from a stack of nodes and the text closing
+    # them rather than by recursion, so tree depth is not limited and
+    # deep trees are not copied once per level
+    def length_str(n):
+        if n.length is not None:
+            return length_fmt % n.length
+        return ""
+
+    parts = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, str):
+            parts.append(n)
+        elif n.istip:
+            parts.append("%s%s" % (n.label, length_str(n)))
+        else:
+            parts.append("(")
+            stack.append(")%s%s" % (n.label or "", length_str(n)))
+            for i in range(len(n.children) - 1, -1, -1):
+                stack.append(n.children[i])
+                if i:
+                    stack.append(",")
+    return "".join(parts)
 
 
 tostring = to_string
 
 
-def parse_from_file(filename):
+def parse_from_file(filename, node_class=Node):
     if filename == '-':
         file = sys.stdin
     else:
         file = open(filename, 'r')
     content = file.read().strip()
     treedescs = content.split(";")
-    tree = parse(treedescs[0])
+    tree = parse(treedescs[0], node_class=node_class)
     file.close()
     return tree
 
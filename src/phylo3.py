@@ -1,22 +1,27 @@
 # import sets
 
+from collections import deque
+
 PREORDER = 0
 POSTORDER = 1
+LEVELORDER = 2
 BRANCHLENGTH = 0
 INTERNODES = 1
 
 
-class Node:
-    def __init__(self):
-        self.data = {}
-        self.isroot = False
-        self.istip = False
-        self.label = None
-        self.length = 0
-        self.parent = None
-        self.children = []
-        self.nchildren = 0
-        self.excluded_dists = []
+class BaseNode:
+    """Methods shared by Node and CompactNode. Nodes a method creates are
+    of the same class as the node it is called on.
+
+    leaves(), find_descendant() and lca_index() cache the tips, a label
+    index and an LCAIndex of the subtree on the node they are called on.
+    add_child and remove_child (and so prune, graft and reroot) drop the
+    caches of the node changed and the nodes above it, and add_child also
+    drops those of a child's previous parent. _cached is set on every node
+    below a cache, so dropping stops at the first node with nothing cached
+    above it, and building a tree does not walk to the root for each node
+    added"""
+    __slots__ = ()
 
     def order_subtrees_by_size(self, n2s=None, recurse=False, reverse=False):
         if n2s is None:
@@ -27,63 +32,126 @@ class Node:
             if reverse:
                 v.reverse()
             self.children = [x[-1] for x in v]
+            self.invalidate()  # leaves are now in a different order
             if recurse:
-                for c in self.children:
-                    c.order_subtrees_by_size(n2s, recurse=True,
-                                             reverse=reverse)
+                for c in self.descendants():
+                    c.order_subtrees_by_size(n2s, reverse=reverse)
 
     def add_child(self, child):
         assert child not in self.children
+        if child.parent is not None:  # moved without remove_child
+            child.parent.invalidate()
         self.children.append(child)
         child.parent = self
         self.nchildren += 1
+        self.invalidate()
 
     def remove_child(self, child):
         assert child in self.children
         self.children.remove(child)
         child.parent = None
         self.nchildren -= 1
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the cached leaves and label index of self and the nodes
+        above it, after the subtree below self changed"""
+        n = self
+        while n is not None and n._cached:
+            n._leaves = None
+            n._labels = None
+            n._lca = None
+            n._cached = False
+            n = n.parent
+
+    def _leaf_list(self):
+        if self._leaves is not None:
+            return self._leaves
+        nodes = list(self.iternodes())
+        leaves = [n for n in nodes if n.istip]
+        if _mark_cached(nodes):
+            self._leaves = leaves
+        return leaves
 
     def leaves(self):
-        return [n for n in self.iternodes() if n.istip]
+        return list(self._leaf_list())
+
+    def ntips(self):
+        """Number of tips below self, without copying the leaves"""
+        return len(self._leaf_list())
 
     def iternodes(self, order=POSTORDER, v=None):
         """
-        returns a list of nodes descendant from self - including self
+        yields the nodes descendant from self - including self - in
+        PREORDER, POSTORDER or LEVELORDER (breadth first). uses a stack
+        rather than recursion, so tree depth is not limited. each node's
+        children are read when the walk reaches it
         """
+        if order == LEVELORDER:
+            queue = deque([self])
+            while queue:
+                node = queue.popleft()
+                yield node
+                queue.extend(node.children)
+            return
         if order == PREORDER:
             yield self
-        for child in self.children:
-            for d in child.iternodes(order):
-                yield d
-        if order == POSTORDER:
-            yield self
+        stack = [(self, iter(self.children))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if order == POSTORDER:
+                    yield node
+            else:
+                if order == PREORDER:
+                    yield child
+                stack.append((child, iter(child.children)))
 
     def descendants(self, order=PREORDER, v=None):
         """
         returns a list of nodes descendant from self - not including self!
+        POSTORDER gives the reverse of PREORDER, so children come before
+        their parents. nodes are added to the end of v for PREORDER and
+        LEVELORDER and to the start for POSTORDER
         """
         if v is None:
             v = []
-        assert order in (PREORDER, POSTORDER)
-        for child in self.children:
-            if order == PREORDER:
-                v.append(child)
-            else:
-                v.insert(0, child)
-            if child.children:
-                child.descendants(order, v)
+        assert order in (PREORDER, POSTORDER, LEVELORDER)
+        nodes = self.iternodes(LEVELORDER if order == LEVELORDER
+                               else PREORDER)
+        next(nodes)  # self
+        if order == POSTORDER:
+            v[:0] = reversed(list(nodes))
+        else:
+            v.extend(nodes)
         return v
 
     def find_descendant(self, label):
-        if label == self.label:
-            return self
-        else:
-            for child in self.children:
-                n = child.find_descendant(label)
-                if n:
-                    return n
-        return None
+        """first node in preorder with label, looked up in an index of the
+        subtree. labels can change without the tree knowing, so a hit is
+        checked against the node's label and a miss rebuilds the index"""
+        if self._labels is not None:
+            node = self._labels.get(label)
+            if node is not None and node.label == label:
+                return node
+        nodes = list(self.iternodes(PREORDER))
+        labels = {}
+        for node in nodes:
+            labels.setdefault(node.label, node)
+        if _mark_cached(nodes):
+            self._labels = labels
+        return labels.get(label)
+
+    def lca_index(self):
+        """LCAIndex of the subtree, kept until the subtree changes"""
+        if self._lca is not None:
+            return self._lca
+        index = LCAIndex(self)
+        if _mark_cached(list(index.first)):
+            self._lca = index
+        return index
 
     def prune(self):
         p = self.parent
@@ -94,7 +162,7 @@ class Node:
     def graft(self, node):
         parent = self.parent
         parent.remove_child(self)
-        n = Node()
+        n = type(self)()
         n.add_child(self)
         n.add_child(node)
         parent.add_child(n)
@@ -106,25 +174,25 @@ class Node:
         """
         if store is None:
             store = {}
-        leaf2len = {}
-        if self.children:
-            for child in self.children:
-                if measure == BRANCHLENGTH:
-                    assert child.length is not None
-                    dist = child.length
-                elif measure == INTERNODES:
-                    dist = 1
-                else:
-                    raise "InvalidMeasure"
-                child.leaf_distances(store, measure)
-                if child.istip:
-                    leaf2len[child.label] = dist
-                else:
-                    for k, v in store[child].items():
-                        leaf2len[k] = v + dist
-        else:
-            leaf2len[self] = {self.label: 0}
-        store[self] = leaf2len
+        for node in self.iternodes(POSTORDER):
+            leaf2len = {}
+            if node.children:
+                for child in node.children:
+                    if measure == BRANCHLENGTH:
+                        assert child.length is not None
+                        dist = child.length
+                    elif measure == INTERNODES:
+                        dist = 1
+                    else:
+                        raise "InvalidMeasure"
+                    if child.istip:
+                        leaf2len[child.label] = dist
+                    else:
+                        for k, v in store[child].items():
+                            leaf2len[k] = v + dist
+            else:
+                leaf2len[node] = {node.label: 0}
+            store[node] = leaf2len
         return store
 
     def rootpath(self):
@@ -150,7 +218,7 @@ class Node:
             path = list(tip.rootpath())
             for node in path:
                 if node not in d:
-                    newnode = Node()
+                    newnode = type(self)()
                     newnode.istip = node.istip
                     newnode.length = node.length
                     newnode.label = node.label
@@ -214,16 +282,90 @@ class Node:
         return sisters
 
 
+class Node(BaseNode):
+    def __init__(self):
+        self.data = {}
+        self.isroot = False
+        self.istip = False
+        self.label = None
+        self.length = 0
+        self.parent = None
+        self.children = []
+        self.nchildren = 0
+        self.excluded_dists = []
+        self._leaves = None
+        self._labels = None
+        self._lca = None
+        self._cached = False
+
+
+class CompactNode(BaseNode):
+    """Node without a __dict__, for large trees. data and excluded_dists,
+    which most nodes never use, are only created when first accessed"""
+    __slots__ = ("isroot", "istip", "label", "length", "parent", "children",
+                 "nchildren", "_data", "_excluded_dists", "_leaves",
+                 "_labels", "_lca", "_cached")
+
+    def __init__(self):
+        self.isroot = False
+        self.istip = False
+        self.label = None
+        self.length = 0
+        self.parent = None
+        self.children = []
+        self.nchildren = 0
+        self._data = None
+        self._excluded_dists = None
+        self._leaves = None
+        self._labels = None
+        self._lca = None
+        self._cached = False
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = {}
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def excluded_dists(self):
+        if self._excluded_dists is None:
+            self._excluded_dists = []
+        return self._excluded_dists
+
+    @excluded_dists.setter
+    def excluded_dists(self, value):
+        self._excluded_dists = value
+
+
+def _mark_cached(nodes):
+    """Flag the nodes of a subtree as below a cache, unless one of them
+    still lists a child that has been moved to another parent (as the kink
+    remove_kink leaves behind does): edits below that child would not reach
+    the cache, so it is not kept. Returns whether it can be kept"""
+    for n in nodes:
+        for c in n.children:
+            if c.parent is not n:
+                return False
+    for n in nodes:
+        n._cached = True
+    return True
+
+
 def node2size(node, d=None):
     "map node and descendants to number of descendant tips"
     if d is None:
         d = {}
-    size = int(node.istip)
-    if not node.istip:
-        for child in node.children:
-            node2size(child, d)
-            size += d[child]
-    d[node] = size
+    for n in node.iternodes(POSTORDER):
+        size = int(n.istip)
+        if not n.istip:
+            for child in n.children:
+                size += d[child]
+        d[n] = size
     return d
 
 
@@ -250,63 +392,101 @@ def reroot(oldroot, newroot):
     return newroot
 
 
+class LCAIndex:
+    """Most recent common ancestor queries on the tree below root: O(1)
+    for a pair of nodes and O(k) for k nodes, after an O(n log n) build.
+    The walk down and back up every edge (Euler tour) passes the MRCA of
+    two nodes as the shallowest node between their first visits, found
+    from a sparse table of the shallowest node over each power-of-two
+    stretch of the tour. Build it again if the tree changes, or use
+    root.lca_index(), which does"""
+    def __init__(self, root):
+        euler = [root]  # nodes in the order the tour visits them
+        depths = [0]
+        first = {root: 0}  # node to its first visit
+        stack = [(root, 0, iter(root.children))]
+        while stack:
+            node, depth, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if stack:  # back up to the parent
+                    euler.append(stack[-1][0])
+                    depths.append(depth - 1)
+            else:
+                first[child] = len(euler)
+                euler.append(child)
+                depths.append(depth + 1)
+                stack.append((child, depth + 1, iter(child.children)))
+        self.euler = euler
+        self.first = first
+        # visits as depth * m + position, so min() gives the shallowest
+        self.m = m = len(euler)
+        row = [d * m + i for i, d in enumerate(depths)]
+        self.table = [row]
+        span = 1
+        while 2 * span <= m:
+            row = [a if a < b else b for a, b in zip(row, row[span:])]
+            self.table.append(row)
+            span *= 2
+        self.index_tips()
+
+    def index_tips(self):
+        """Map each tip label to its tips, in tree order"""
+        self.tips = {}
+        for node in self.first:
+            if node.istip:
+                self.tips.setdefault(node.label, []).append(node)
+
+    def _shallowest(self, i, j):
+        k = (j - i + 1).bit_length() - 1
+        row = self.table[k]
+        return self.euler[min(row[i], row[j - (1 << k) + 1]) % self.m]
+
+    def mrca(self, node1, node2):
+        """MRCA of two nodes"""
+        i, j = self.first[node1], self.first[node2]
+        if i > j:
+            i, j = j, i
+        return self._shallowest(i, j)
+
+    def mrca_set(self, nodes):
+        """MRCA of nodes, that of the first and last of them visited"""
+        visits = [self.first[n] for n in nodes]
+        return self._shallowest(min(visits), max(visits))
+
+    def find_tips(self, names):
+        """Tips labelled with any of names. Tips can be relabelled without
+        the index knowing, so a name that is missing or no longer matches
+        rebuilds the label table, at most once per call"""
+        rebuilt = False
+        found = []
+        for name in names:
+            tips = self.tips.get(name)
+            if not rebuilt and (tips is None or
+                                any(t.label != name for t in tips)):
+                self.index_tips()
+                rebuilt = True
+                tips = self.tips.get(name)
+            found.extend(tips or [])
+        return found
+
+
 def getMRCA(innames, tree):
-    mrca = None
     if len(innames) == 1:
         return None
-    else:
-        outgroup = []
-        for name in innames:
-            for i in range(len(tree.leaves())):
-                if tree.leaves()[i].label == name:
-                    outgroup.append(tree.leaves()[i])
-                    # print tree.leaves[i].label
-        cur2 = None
-        tempmrca = None
-        cur1 = outgroup.pop()
-        while len(outgroup) > 0:
-            cur2 = outgroup.pop()
-            tempmrca = getMRCATraverse(cur1, cur2)
-            cur1 = tempmrca
-        mrca = cur1
-    return mrca
+    index = tree.lca_index()
+    return index.mrca_set(index.find_tips(innames))
 
 
 def getMRCATraverse(curn1, curn2):
-    mrca = None
-    # get path to root for first node
-    path1 = []
-    parent = curn1
-    path1.append(parent)
-    while parent is not None:
-        path1.append(parent)
-        if parent.parent is not None:
-            parent = parent.parent
-        else:
-            break
-    # find first match between this node and the first one
-    parent = curn2
-    x = True
-    while x:
-        for i in range(len(path1)):
-            if parent == path1[i]:
-                mrca = parent
-                x = False
-                break
-        parent = parent.parent
-    return mrca
+    return getMRCATraverseFromPath(list(curn1.rootpath()), curn2)
 
 
 def getMRCATraverseFromPath(path1, curn2):
-    mrca = None
     # find first match between this node and the first one
+    path1 = set(path1)
     parent = curn2
-    x = True
-    while x:
-        for i in range(len(path1)):
-            if parent == path1[i]:
-                mrca = parent
-                x = False
-                break
+    while parent not in path1:
         parent = parent.parent
-    return mrca
+    return parent
@@ -0,0 +1,87 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import json
+import argparse
+import logging
+import runner
+from concurrent.futures import ProcessPoolExecutor
+from utils import index_fasta
+from cache import file_digest
+from search_proteomes import collect_dbs, read_manifest, has_blast_db, \
+    make_blast_db, build_merged_db, count_residues
+
+
+def prepare_one(db, blast=False):
+    """Build the offset index (and BLAST DB if blast) of a sequence DB and
+    return its manifest entry"""
+    st = os.stat(db)
+    index = index_fasta(db)
+    nres = count_residues(db)
+    if blast and not has_blast_db(db):
+        make_blast_db(db)
+    return {"size": st.st_size, "mtime": st.st_mtime_ns,
+            "sha256": file_digest(db), "nseq": len(index), "nres": nres,
+            "blastdb": blast or has_blast_db(db)}
+
+
+def prepare_db(database_dir, nt=1, blast=False, merged=False, dbkeep=None):
+    """Build every BLAST DB, offset index and length table for the sequence
+    DBs in database_dir in parallel, recording checksums and lengths in
+    database_dir/manifest.json. DBs unchanged since the last run are
+    skipped"""
+    dblist = collect_dbs(database_dir, dbkeep)
+    manifest = {os.path.basename(db): entry for db, entry in
+                read_manifest(database_dir).items()}
+    todo = [db for db in dblist
+            if os.path.basename(db) not in manifest
+            or (blast and not manifest[os.path.basename(db)]["blastdb"])
+            or not os.path.isfile(db + ".idx")]
+    print(f"Preparing {len(todo)} of {len(dblist)} sequence DBs")
+    logging.info(f"preparing {len(todo)} of {len(dblist)} sequence DBs in "
+                 f"{database_dir} with {nt} worker(s)")
+    with ProcessPoolExecutor(max_workers=max(1, int(nt)),
+                             initializer=runner.configure,
+                             initargs=(runner.TIMEOUT, runner.STATS)) as pool:
+        futures = {db: pool.submit(prepare_one, db, blast) for db in todo}
+        if merged:
+            mdb, rebuilt = build_merged_db(dblist, database_dir)
+            if blast and (rebuilt or not has_blast_db(mdb)):
+                make_blast_db(mdb)
+        for db, fut in futures.items():
+            manifest[os.path.basename(db)] = fut.result()
+    with open(os.path.join(database_dir, "manifest.json.tmp"), "w") as f:
+        json.dump({"files": manifest}, f, indent=1)
+    os.replace(os.path.join(database_dir, "manifest.json.tmp"),
+               os.path.join(database_dir, "manifest.json"))
+    return os.path.join(database_dir, "manifest.json")
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_dir", help="Directory containing sequence \
+                        databases to prepare")
+    parser.add_argument("-b", "--blast", help="Also build BLAST DBs",
+                        action="store_true")
+    parser.add_argument("-md", "--merged", help="Also build the merged DB \
+                        used by search_proteomes.py --merged",
+                        action="store_true")
+    parser.add_argument("-t", "--threads", help="Number of DBs to prepare \
+                        at once (default 1)", type=int, default=1)
+    parser.add_argument("-dbl", "--dblist", help="Text file with files in \
+                        database_dir to prepare, if not all, one per line")
+    args = parser.parse_args()
+
+    if args.dblist is not None:
+        DBLIST = []
+        with open(args.dblist, "r") as f:
+            for line in f:
+                DBLIST.append(line.strip())
+    else:
+        DBLIST = None
+    prepare_db(args.database_dir, args.threads, args.blast, args.merged,
+               DBLIST)
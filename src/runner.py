@@ -0,0 +1,130 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+import logging
+
+# defaults for every run(), set once per pipeline with configure()
+TIMEOUT = None  # seconds
+STATS = None  # tsv file to append per-call resource use to
+
+
+def configure(timeout=None, stats=None):
+    """Set the per-call timeout in seconds and the file that resource use
+    of each external call is appended to"""
+    global TIMEOUT, STATS
+    TIMEOUT = timeout
+    STATS = stats
+
+
+def _drain(pipe, lines=None, echo=False):
+    """Read a pipe to the end so the child never blocks on a full pipe,
+    keeping the lines read if lines is a list"""
+    for line in pipe:
+        line = line.decode(errors="replace")
+        if echo:
+            print(line.rstrip())
+        if lines is not None:
+            lines.append(line)
+    pipe.close()
+
+
+def _write_stats(cmd, stats):
+    if STATS is None:
+        return
+    with open(STATS, "a") as outf:  # one append per line, safe across jobs
+        outf.write("\t".join([os.path.basename(cmd[0]),
+                              str(stats["returncode"]),
+                              f"{stats['wall']:.3f}", f"{stats['cpu']:.3f}",
+                              f"{stats['maxrss']:.1f}",
+                              subprocess.list2cmdline(cmd)]) + "\n")
+
+
+def run(cmd, stdout=None, capture=False, echo=False, timeout=None,
+        check=True):
+    """Run cmd without a shell, waiting without polling. stdout can be an
+    open file to write the output to, otherwise output is read in a
+    separate thread and returned if capture, and discarded if not. stderr
+    is drained the same way and printed if echo. The call is killed after
+    timeout seconds (default runner.TIMEOUT), raising TimeoutExpired, and
+    a non-zero exit raises CalledProcessError if check. The call runs in
+    its own process group, which is killed as a whole, so programs that are
+    wrappers (like mafft) do not leave workers running. Wall time, CPU time
+    of the child and its peak RSS in MB are logged. Returns a
+    CompletedProcess with the stats as its stats attribute"""
+    if timeout is None:
+        timeout = TIMEOUT
+    print(subprocess.list2cmdline(cmd))
+    logging.info(subprocess.list2cmdline(cmd))
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, shell=False,
+                            stdout=subprocess.PIPE if stdout is None else
+                            stdout, stderr=subprocess.PIPE,
+                            start_new_session=True)
+    out, err = [], []
+    readers = [threading.Thread(target=_drain, args=(proc.stderr, err, echo),
+                                daemon=True)]
+    if stdout is None:
+        readers.append(threading.Thread(target=_drain, args=(
+            proc.stdout, out if capture else None), daemon=True))
+    for r in readers:
+        r.start()
+
+    # the timer stays armed until the pipes are drained, so workers left
+    # holding them by the child count against the timeout too
+    lock = threading.Lock()
+    state = {"done": False, "killed": False}
+
+    def kill():
+        with lock:
+            if not state["done"]:
+                state["killed"] = True
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:  # the whole group has exited
+                    pass
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except BaseException:  # e.g. ctrl-c, which the new session does not get
+        kill()
+        raise
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    for r in readers:
+        r.join()
+    with lock:
+        state["done"] = True
+    if timer is not None:
+        timer.cancel()
+
+    maxrss = rusage.ru_maxrss / 1024  # KB on linux
+    if sys.platform == "darwin":  # bytes on mac
+        maxrss /= 1024
+    stats = {"returncode": proc.returncode,
+             "wall": time.monotonic() - start,
+             "cpu": rusage.ru_utime + rusage.ru_stime,
+             "maxrss": maxrss}
+    logging.info(f"{os.path.basename(cmd[0])} exited {proc.returncode}: "
+                 f"wall {stats['wall']:.1f}s, cpu {stats['cpu']:.1f}s, "
+                 f"max rss {stats['maxrss']:.1f}MB")
+    _write_stats(cmd, stats)
+
+    out = "".join(out) if capture else None
+    err = "".join(err)
+    if state["killed"]:
+        sys.stderr.write(f"{cmd[0]} killed after {timeout}s\n")
+        raise subprocess.TimeoutExpired(cmd, timeout, out, err)
+    if check and proc.returncode != 0:
+        sys.stderr.write(err[-2000:])
+        raise subprocess.CalledProcessError(proc.returncode, cmd, out, err)
+    result = subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+    result.stats = stats
+    return result
@@ -3,10 +3,24 @@
 import sys
 import os
 import subprocess
+import glob
 import argparse
 import shutil
+import tempfile
+import heapq
+import json
+import hashlib
 import logging
-from utils import parse_fasta
+from itertools import islice, groupby
+from utils import parse_fasta, fetch_sequences, load_fasta_index
+from seqstore import build_store, get_sequences
+import runner
+from executor import get_executor
+from cache import file_digest, file_digests, make_key, cache_get, cache_put, \
+    evict
+
+# E-value up to which hmmsearch and blastp report hits by default
+REPORT_EVALUE = 10.0
 
 
 def fasta_to_stockholm(inf):
@@ -21,116 +35,651 @@ def fasta_to_stockholm(inf):
     else:
         print("Aligning baits with FSA")
         cmd = ["fsa", "--fast", "--stockholm", inf]
-        print(subprocess.list2cmdline(cmd))
-        out = subprocess.run(cmd, shell=False, capture_output=True,
-                             text=True).stdout
+        out = runner.run(cmd, capture=True).stdout
         with open(inf + ".sto", "w") as outf:
             outf.write(out)
 
 
-def stockholm_to_profile(sto):
+def stockholm_to_profile(sto, name=None):
     print("Building hmm profile")
     cmd = ["hmmbuild", sto[:-3] + "hmm", sto]
-    print(subprocess.list2cmdline(cmd))
-    subprocess.run(cmd, shell=False)
+    if name is not None:
+        cmd[1:1] = ["-n", name]
+    runner.run(cmd)
 
 
-def hmmsearch_db(hmm, dbf):
+def hmmsearch_db(hmm, dbf, nt=None, nseq=None, evalue=None):
     print("Searching database with hmm")
-    cmd = ["hmmsearch", "--noali", "--tblout", dbf + ".out", hmm, dbf]
-    print(subprocess.list2cmdline(cmd))
-    subprocess.run(cmd, shell=False)
+    cmd = ["hmmsearch", "--noali", "--tblout", dbf + ".out"]
+    if nt is not None:
+        cmd += ["--cpu", str(nt)]
+    if nseq is not None:  # E-values as if searching nseq sequences
+        cmd += ["-Z", str(nseq)]
+    if evalue is not None:  # report hits up to this E-value
+        cmd += ["-E", f"{evalue:g}"]
+    cmd += [hmm, dbf]
+    runner.run(cmd)
+
+
+def hmmscan_db(hmmdb, dbf, nt=1):
+    """Scan each sequence in dbf against all profiles in hmmdb. E-values
+    are calculated for the number of sequences in dbf, as for hmmsearch"""
+    print("Scanning database with hmm profiles")
+    nseq = len(load_fasta_index(dbf))
+    cmd = ["hmmscan", "--noali", "--tblout", dbf + ".scan.out", "-Z",
+           str(nseq), "--cpu", str(nt), hmmdb, dbf]
+    runner.run(cmd)
+
+
+def has_blast_db(dbf):
+    blastdbsuf = [".pdb", ".phr", ".pin", ".pog", ".pos", ".pot", ".psq",
+                  ".ptf", ".pto"]
+    return all(os.path.isfile(dbf + s) for s in blastdbsuf)
 
 
 def make_blast_db(dbf):
     print("Making blastdb")
     cmd = ["makeblastdb", "-in", dbf, "-dbtype", "prot", "-parse_seqids"]
-    print(subprocess.list2cmdline(cmd))
-    subprocess.run(cmd, shell=False)
+    runner.run(cmd)
 
 
-def blast_db(bait, dbf, nt):
+def blast_db(bait, dbf, nt, dbsize=None, evalue=REPORT_EVALUE,
+             max_targets=None):
     print("Searching database with blastp")
-    blastout = dbf + "." + bait + ".blastp.outfmt6"
+    blastout = dbf + "." + os.path.basename(bait) + ".blastp.outfmt6"
     cmd = ["blastp", "-query", bait, "-db", dbf, "-num_threads", str(nt),
-           "-evalue", "10", "-out", blastout, "-outfmt",
+           "-evalue", f"{evalue:g}", "-out", blastout, "-outfmt",
            "6 qseqid sseqid evalue bitscore"]
-    print(subprocess.list2cmdline(cmd))
-    subprocess.run(cmd, shell=False)
+    if dbsize is not None:  # E-values as if searching dbsize residues
+        cmd += ["-dbsize", str(dbsize)]
+    if max_targets is not None:  # instead of blastp's default of 500
+        cmd += ["-max_target_seqs", str(max_targets)]
+    runner.run(cmd)
     return blastout
 
 
-def parse_hmmsearch_out(outf):
-    """"Parse hmmsearch output with -tblout"""
-    print("Parsing hmmsearch output")
-    hits = open(outf[:-3] + "hits", "w")
+def get_taxon(seqid):
+    """Taxon of a taxon@seqid sequence name"""
+    return seqid.split("@")[0]
+
+
+def iter_tblout(outf):
+    """Stream (target, evalue, bitscore) for each hit in hmmsearch output
+    with -tblout"""
     with open(outf, "r") as search_out:
         for line in search_out:
             if not line.startswith("#"):
-                hits.write(line.split(" ")[0].strip() + "\n")
-    hits.close()
+                line = line.split(None, 6)
+                yield line[0], float(line[4]), float(line[5])
 
 
-def parse_blastp_out(outf, min_bitscore=30.0, thresh=0.1):
-    """Parse blastp outfmt 6 with columns qseqid sseqid evalue bitscore
-    By default ignores hits with bitscore < 30.0 and < 0.1 * max bitscore of
-    that query"""
-    sys.stderr.write("Parsing blastp output\n")
-    hitsfilename = outf[:-7] + "hits"
-    hitsfile = open(hitsfilename, "w")
-    hits = []
+def iter_hit_table(tbl):
+    """Stream (target, evalue, bitscore) from a compact hit table"""
+    with open(tbl, "r") as f:
+        for line in f:
+            target, evalue, bitscore = line.rstrip("\n").split("\t")
+            yield target, float(evalue), float(bitscore)
+
+
+def top_hits(hits, nhits=None, max_evalue=None, min_score=None, group=None,
+             table=None):
+    """Filter a stream of (target, evalue, bitscore) hits by E-value and
+    bitscore as they are read, keeping the best nhits by bitscore in a
+    bounded heap, per group(target) if group is given. If table is an open
+    file, every hit read is written to it. Returns the kept hits, best
+    first, ties kept in input order"""
+    heaps = {}
+    for i, (target, evalue, bitscore) in enumerate(hits):
+        if table is not None:
+            table.write(f"{target}\t{evalue:g}\t{bitscore:g}\n")
+        if max_evalue is not None and evalue > max_evalue:
+            continue
+        if min_score is not None and bitscore < min_score:
+            continue
+        heap = heaps.setdefault(group(target) if group else None, [])
+        item = (bitscore, -i, target, evalue)
+        if nhits is None or len(heap) < nhits:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+    kept = sorted((x for heap in heaps.values() for x in heap), reverse=True)
+    return [(target, evalue, bitscore) for bitscore, _, target, evalue
+            in kept]
+
+
+def write_hits(hits, hitsf):
+    with open(hitsf, "w") as f:
+        for target, _, _ in hits:
+            f.write(target + "\n")
+    return hitsf
+
+
+def rescale_evalues(hits, scale):
+    """Multiply the E-value of each (target, evalue, bitscore) hit by
+    scale(target), dropping hits that would then not have been reported"""
+    for target, evalue, bitscore in hits:
+        evalue *= scale(target)
+        if evalue <= REPORT_EVALUE:
+            yield target, evalue, bitscore
+
+
+def parse_hmmsearch_out(outf, nhits=None, max_evalue=None, min_score=None,
+                        group=None, scale=None):
+    """"Parse hmmsearch output with -tblout in a single pass, writing every
+    hit to a compact hit table (.tbl) and the ids of the hits kept by
+    top_hits to a hits file (.hits). E-values are rescaled first if scale
+    is given (see rescale_evalues)"""
+    print("Parsing hmmsearch output")
+    hits = iter_tblout(outf)
+    if scale is not None:
+        hits = rescale_evalues(hits, scale)
+    with open(outf[:-3] + "tbl", "w") as table:
+        hits = top_hits(hits, nhits, max_evalue, min_score, group, table)
+    return write_hits(hits, outf[:-3] + "hits")
+
+
+def filter_hit_table(tbl, nhits=None, max_evalue=None, min_score=None,
+                     group=None):
+    """Re-filter a compact hit table without searching again, writing the
+    ids of the hits kept to a hits file"""
+    hits = top_hits(iter_hit_table(tbl), nhits, max_evalue, min_score,
+                    group)
+    return write_hits(hits, tbl[:-3] + "hits")
+
+
+def write_run_table(dblist, table):
+    """Combine the compact hit tables of each DB in dblist into a single
+    run table with columns db, target, evalue and bitscore"""
+    with open(table, "w") as outf:
+        for db in dblist:
+            if not os.path.isfile(db + ".tbl"):
+                continue
+            with open(db + ".tbl", "r") as inf:
+                for line in inf:
+                    outf.write(db + "\t" + line)
+            os.remove(db + ".tbl")
+    logging.info(f"writing hit table to {table}")
+    return table
+
+
+def hits_from_table(table, outfile, nhits=None, max_evalue=None,
+                    min_score=None, store=None):
+    """Rebuild a hits FASTA from a run table written by a previous search,
+    with new thresholds and hit cap. Returns outfile"""
+    if os.path.isfile(outfile):
+        os.remove(outfile)  # prevent appending partial file
+    with open(table, "r") as f:
+        rows = (line.rstrip("\n").split("\t") for line in f)
+        for db, dbrows in groupby(rows, key=lambda x: x[0]):
+            if os.path.basename(db).startswith("merged."):
+                group = get_taxon  # -k applies per taxon
+            else:
+                group = None
+            hits = top_hits(((x[1], float(x[2]), float(x[3]))
+                             for x in dbrows), nhits, max_evalue, min_score,
+                            group)
+            hitsf = write_hits(hits, outfile + ".hits")
+            gather_sequences(hitsf, db, outfile, store=store)
+            os.remove(hitsf)
+    return outfile
+
+
+def parse_hmmscan_out(outf, families):
+    """Parse hmmscan output with -tblout, splitting hits by profile into a
+    hits file per family, each sorted by E-value. Returns a dict of
+    family: hits file"""
+    print("Parsing hmmscan output")
+    hits = {fam: [] for fam in families}
+    with open(outf, "r") as scan_out:
+        for line in scan_out:
+            if not line.startswith("#"):
+                line = line.split()
+                hits[line[0]].append((float(line[4]), line[2]))
+    hitsfiles = {}
+    for fam in families:
+        hitsfiles[fam] = outf[:-8] + fam + ".hits"
+        with open(hitsfiles[fam], "w") as f:
+            for _, h in sorted(hits[fam], key=lambda x: x[0]):
+                f.write(h + "\n")
+    return hitsfiles
+
+
+def iter_blastp_out(outf):
+    """Stream (qseqid, sseqid, evalue, bitscore) from blastp outfmt 6 with
+    columns qseqid sseqid evalue bitscore"""
     with open(outf, "r") as f:
         for line in f:
             # out is four columns, qid, sid, evalue, bitscore
-            line = line.strip().split("\t")
-            q, h, b = line[0], line[1], float(line[3])
-            if q != h and b > min_bitscore:  # filter self and lower than min
-                hits.append((h, b))
-    highest = 0.0
-    currentq = ""
-    hits_filtered = []  # contains hits after bitscore filtering
-    for h in hits:
-        # here we filter hits with respect to highest score of that query
-        if h[0] == currentq:
+            line = line.rstrip("\n").split("\t")
+            yield line[0], line[1], float(line[2]), float(line[3])
+
+
+def parse_blastp_out(outf, min_bitscore=30.0, thresh=0.1, per_query=None,
+                     scale=None):
+    """Parse blastp outfmt 6 with columns qseqid sseqid evalue bitscore
+    By default ignores hits with bitscore < 30.0 and < 0.1 * max bitscore of
+    that query. Hits are streamed one query at a time, keeping the best HSP
+    of each subject and then at most per_query subjects of each query, and
+    each subject is kept once with its best bitscore. E-values are rescaled first if scale is given (see
+    rescale_evalues). Writes subjects to the hits file best first"""
+    sys.stderr.write("Parsing blastp output\n")
+    hits = iter_blastp_out(outf)
+    if scale is not None:
+        hits = ((q, h, e * scale(h), b) for q, h, e, b in hits
+                if e * scale(h) <= REPORT_EVALUE)
+    subjects = {}  # subject: (evalue, bitscore) of its best kept hit
+    for q, qhits in groupby(hits, key=lambda x: x[0]):
+        # filter self and lower than min, keeping the best HSP of each
+        # subject so repeated HSPs do not use up per_query
+        best = {}
+        for _, h, e, b in qhits:
+            if q != h and b > min_bitscore and (h not in best or
+                                                b > best[h][1]):
+                best[h] = (e, b)
+        kept = top_hits(((h, e, b) for h, (e, b) in best.items()),
+                        per_query)
+        if not kept:
             continue
-        else:
-            currentq = h[0]
-            highest = h[1]
-        if h[1] > thresh * highest:
-            hits_filtered.append(h)
-    hits_filtered = [x[0] for x in sorted(hits_filtered, key=lambda x: x[1],
-                                          reverse=True)]
-    hits_unique = list(set(hits_filtered))
-    for h in hits_unique:
-        hitsfile.write(h + "\n")
-    hitsfile.close()
-    return hitsfilename
-
-
-def gather_sequences(hitsf, dbf, outf, nhits: int = None):
+        highest = kept[0][2]  # best score of this query
+        for h, e, b in kept:
+            if b > thresh * highest and (h not in subjects or
+                                         b > subjects[h][1]):
+                subjects[h] = (e, b)
+    hits = top_hits((h, e, b) for h, (e, b) in subjects.items())
+    return write_hits(hits, outf[:-7] + "hits")
+
+
+def gather_sequences(hitsf, dbf, outf, nhits: int = None, store=None):
     """Takes a per db hits file and agglomerates sequences for hits,
-    optionally with a numerical cutoff of hits to keep"""
+    optionally with a numerical cutoff of hits to keep. Sequences are taken
+    from the sequence store if given, otherwise from dbf"""
     print("Compiling sequences")
     seqout = open(outf, "a")
-    if nhits is not None:
-        seql = [x.rstrip("\n") for x in open(hitsf, "r").readlines()[:nhits]]
+    with open(hitsf, "r") as f:
+        seql = [x.rstrip("\n") for x in islice(f, nhits)]
+    if store is not None:
+        seqs = get_sequences(store, seql)
     else:
-        seql = [x.rstrip("\n") for x in open(hitsf, "r").readlines()]
-    dbdict = dict([x for x in parse_fasta(dbf)])
-    for s in seql:
+        seqs = fetch_sequences(dbf, seql)
+    for s, seq in seqs:
         seqout.write(">" + s + "\n")
-        seqout.write(dbdict[s] + "\n")
+        seqout.write(seq + "\n")
     seqout.close()
 
 
-def search_proteomes(bait, database_dir, output_dir, blast=False, nhits=None,
-                     nt=1, min_bitscore=30.0, thresh=0.1, dbkeep=None):
-    # file name
-    if "/" in bait:
-        name = bait.split("/")[-1].split(".")[0]
+def cap_hits_per_taxon(hitsf, nhits):
+    """Rewrite a hits file keeping only the first nhits hits of each taxon,
+    taken from the taxon@seqid prefix of each hit"""
+    kept = []
+    counts = {}
+    with open(hitsf, "r") as f:
+        for line in f:
+            taxon = line.split("@")[0]
+            counts[taxon] = counts.get(taxon, 0) + 1
+            if counts[taxon] <= nhits:
+                kept.append(line)
+    with open(hitsf, "w") as f:
+        f.writelines(kept)
+    return hitsf
+
+
+def build_merged_db(dblist, database_dir):
+    """Concatenate the proteomes in dblist into a single merged database in
+    database_dir. The merged file is named from the proteomes it contains
+    and is only rebuilt if any of them has changed. Returns the path and
+    whether it was rebuilt"""
+    names = "\n".join(os.path.basename(db) for db in dblist)
+    merged = os.path.join(database_dir, "merged." +
+                          hashlib.sha1(names.encode()).hexdigest()[:10] +
+                          ".fa")
+    stamp = [f"{db}\t{os.stat(db).st_size}\t{os.stat(db).st_mtime_ns}\n"
+             for db in dblist]
+    if os.path.isfile(merged) and os.path.isfile(merged + ".list"):
+        with open(merged + ".list", "r") as f:
+            if f.readlines() == stamp:
+                logging.info(f"using merged sequence DB {merged}")
+                return os.path.abspath(merged), False
+    logging.info(f"merging {len(dblist)} sequence DBs into {merged}")
+    # written to temporary files and moved into place, the stamp last, so
+    # a concurrent or interrupted run never takes a partial merged DB
+    tmps = []
+    try:
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(merged) + ".",
+                                   suffix=".tmp", dir=database_dir)
+        tmps.append(tmp)
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as outf:
+            for db in dblist:
+                untagged = 0
+                with open(db, "r") as inf:
+                    for line in inf:
+                        if not line.strip():
+                            continue
+                        if line.startswith(">") and "@" not in line:
+                            untagged += 1
+                        outf.write(line.rstrip("\n") + "\n")
+                if untagged > 0:
+                    logging.warning(f"{untagged} sequence(s) in {db} are "
+                                    f"not named taxon@seqid, -k will not "
+                                    f"be applied per taxon for these")
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(merged) + ".",
+                                   suffix=".list.tmp", dir=database_dir)
+        tmps.append(tmp)
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            f.writelines(stamp)
+        os.replace(tmps[0], merged)
+        os.replace(tmps[1], merged + ".list")
+    except BaseException:
+        for tmp in tmps:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    return os.path.abspath(merged), True
+
+
+def taxon_sizes(merged):
+    """Number of sequences and residues of each taxon in a merged DB,
+    counted once and kept in merged + ".taxa" with its size and mtime.
+    Sequences not named taxon@seqid are counted under the empty name"""
+    st = os.stat(merged)
+    stamp = [st.st_size, st.st_mtime_ns]
+    try:
+        with open(merged + ".taxa", "r") as f:
+            recorded = json.load(f)
+        if recorded["stamp"] == stamp:
+            return recorded["taxa"]
+    except (OSError, ValueError, KeyError):
+        pass
+    sizes = {}
+    with open(merged, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                name = line[1:].strip()
+                taxon = sizes.setdefault(get_taxon(name) if "@" in name
+                                         else "", [0, 0])
+                taxon[0] += 1
+            else:
+                taxon[1] += len(line.strip())
+    fd, tmp = tempfile.mkstemp(suffix=".tmp",
+                               dir=os.path.dirname(merged) or ".")
+    os.fchmod(fd, 0o644)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"stamp": stamp, "taxa": sizes}, f)
+    os.replace(tmp, merged + ".taxa")
+    return sizes
+
+
+def taxon_scale(sizes, blast=False):
+    """The search cutoff and the function turning E-values over a merged DB
+    into those of searching each taxon's proteome alone: its share of the
+    sequences for hmmsearch (as -Z) or of the residues for blastp (as
+    -dbsize). E-values of untagged sequences are left as they are"""
+    i = 1 if blast else 0
+    total = max(1, sum(v[i] for v in sizes.values()))
+    tagged = [v[i] for k, v in sizes.items() if k != "" and v[i] > 0]
+    cutoff = REPORT_EVALUE * total / min(tagged) if tagged \
+        else REPORT_EVALUE
+
+    def scale(target):
+        if "@" not in target:
+            return 1.0
+        return sizes.get(get_taxon(target), [total, total])[i] / total
+    return cutoff, scale
+
+
+def search_merged_db(bait, dblist, database_dir, outfile, blast=False,
+                     nhits=None, nt=1, min_bitscore=30.0, thresh=0.1,
+                     store=None, cache_dir=None, baitkey=None,
+                     max_evalue=None, min_score=None, per_query=None):
+    """Search all proteomes in dblist with a single call over a merged
+    database, then apply the hit cap per taxon. The search reports hits up
+    to a relaxed E-value, and E-values are rescaled to those of searching
+    each taxon's proteome alone before filtering, as in a search of each
+    DB"""
+    merged, rebuilt = build_merged_db(dblist, database_dir)
+    sizes = taxon_sizes(merged)
+    cutoff, scale = taxon_scale(sizes, blast)
+    logging.info(f"searching {merged} up to E-value {cutoff:g}, E-values "
+                 f"rescaled to each taxon's proteome")
+    if cache_dir is not None:
+        digest = file_digests([merged], cache_dir)[merged]
+        if blast:
+            key = make_key(baitkey, digest, blast, min_bitscore, thresh,
+                           per_query, "per taxon", "all targets")
+        else:
+            key = make_key(baitkey, digest, "tblout", "per taxon")
     else:
-        name = bait.split(".")[0]
+        key = None
+    if blast:
+        if cache_get(cache_dir, key, [merged + ".hits"]):
+            logging.info(f"using cached hits for {merged}")
+            hits = merged + ".hits"
+        else:
+            if rebuilt or not os.path.isfile(merged + ".pin"):
+                make_blast_db(merged)
+            # blastp's cap of 500 targets applied to each DB searched, so
+            # let a merged search report every sequence
+            nseq = sum(v[0] for v in sizes.values())
+            blastout = blast_db(bait, merged, nt, evalue=cutoff,
+                                max_targets=max(1, nseq))
+            hits = parse_blastp_out(blastout, min_bitscore, thresh,
+                                    per_query, scale)
+            os.remove(blastout)
+            cache_put(cache_dir, key, [hits])
+        if nhits is not None:
+            cap_hits_per_taxon(hits, nhits)
+    else:
+        if cache_get(cache_dir, key, [merged + ".tbl"]):
+            logging.info(f"using cached hits for {merged}")
+            hits = filter_hit_table(merged + ".tbl", nhits, max_evalue,
+                                    min_score, get_taxon)
+        else:
+            hmmsearch_db(bait + ".hmm", merged, nt, evalue=cutoff)
+            hits = parse_hmmsearch_out(merged + ".out", nhits, max_evalue,
+                                       min_score, get_taxon, scale)
+            os.remove(merged + ".out")
+            cache_put(cache_dir, key, [merged + ".tbl"])
+        write_run_table([merged], outfile[:-2] + "tsv")
+    gather_sequences(hits, merged, outfile, store=store)
+    os.remove(hits)
+    return outfile
+
+
+def read_manifest(database_dir):
+    """Return the entries of database_dir/manifest.json written by
+    prepare_db.py, keyed by absolute path, for those DBs unchanged since it
+    was written"""
+    manifest = os.path.join(database_dir, "manifest.json")
+    if not os.path.isfile(manifest):
+        return {}
+    with open(manifest, "r") as f:
+        files = json.load(f)["files"]
+    entries = {}
+    for name, entry in files.items():
+        path = os.path.abspath(os.path.join(database_dir, name))
+        if os.path.isfile(path):
+            st = os.stat(path)
+            if [st.st_size, st.st_mtime_ns] == [entry["size"],
+                                                 entry["mtime"]]:
+                entries[path] = entry
+    return entries
 
+
+def count_residues(dbf):
+    """Count the residues in a FASTA file, used to schedule the largest
+    proteomes first"""
+    nres = 0
+    with open(dbf, "r") as f:
+        for line in f:
+            if not line.startswith(">"):
+                nres += len(line.strip())
+    return nres
+
+
+def split_threads(nt, jobs):
+    """Split a thread budget of nt between concurrent jobs. Returns the
+    number of jobs to run at once and the threads each job gets"""
+    nt = max(1, int(nt))
+    jobs = max(1, min(int(jobs), nt))
+    return jobs, nt // jobs
+
+
+def prefilter_db(bait, db, outfile, prefilter):
+    """Write the candidates of db passing the k-mer prefilter to a
+    temporary FASTA next to outfile. Returns its path and the number of
+    candidates"""
+    from kmer_filter import prefilter as kmer_prefilter  # needs numpy
+    fd, target = tempfile.mkstemp(suffix=".fa",
+                                  dir=os.path.dirname(outfile))
+    os.close(fd)
+    kept, total = kmer_prefilter(bait, db, target, *prefilter)
+    print(f"Prefilter kept {kept} of {total} sequences in {db}")
+    return target, kept
+
+
+def search_db(bait, db, outfile, blast=False, nhits=None, nt=1,
+              min_bitscore=30.0, thresh=0.1, store=None, cache_dir=None,
+              key=None, max_evalue=None, min_score=None, per_query=None,
+              prefilter=None):
+    """Search a single proteome and append its hit sequences to outfile.
+    For hmmsearch, the compact hit table is left at db + ".tbl". If
+    cache_dir is given, the hits (for blastp) or the hit table (for
+    hmmsearch) are cached under key. If prefilter is a (k, min_shared)
+    tuple, only sequences sharing at least min_shared reduced-alphabet
+    k-mers with the baits are searched, with E-values still calculated for
+    the whole proteome"""
+    if blast:
+        if cache_get(cache_dir, key, [db + ".hits"]):
+            print(f"Using cached hits for {db}")
+            hits = db + ".hits"
+        elif prefilter is not None:
+            target, kept = prefilter_db(bait, db, outfile, prefilter)
+            if kept > 0:
+                make_blast_db(target)
+                blastout = blast_db(bait, target, nt, count_residues(db))
+                hits = parse_blastp_out(blastout, min_bitscore, thresh,
+                                        per_query)
+                hits = shutil.move(hits, db + ".hits")
+            else:
+                hits = write_hits([], db + ".hits")
+            for f in glob.glob(glob.escape(target) + "*"):
+                os.remove(f)
+            cache_put(cache_dir, key, [hits])
+        else:
+            if not has_blast_db(db):
+                make_blast_db(db)
+            blastout = blast_db(bait, db, nt)
+            hits = parse_blastp_out(blastout, min_bitscore, thresh,
+                                    per_query)
+            os.remove(blastout)
+            cache_put(cache_dir, key, [hits])
+    else:
+        if cache_get(cache_dir, key, [db + ".tbl"]):
+            print(f"Using cached hits for {db}")
+            hits = filter_hit_table(db + ".tbl", nhits, max_evalue,
+                                    min_score)
+        elif prefilter is not None:
+            target, kept = prefilter_db(bait, db, outfile, prefilter)
+            if kept > 0:
+                hmmsearch_db(bait + ".hmm", target, nt,
+                             len(load_fasta_index(db)))
+                hits = parse_hmmsearch_out(target + ".out", nhits,
+                                           max_evalue, min_score)
+                hits = shutil.move(hits, db + ".hits")
+                shutil.move(target + ".tbl", db + ".tbl")
+            else:
+                open(db + ".tbl", "w").close()
+                hits = write_hits([], db + ".hits")
+            for f in glob.glob(glob.escape(target) + "*"):
+                os.remove(f)
+            cache_put(cache_dir, key, [db + ".tbl"])
+        else:
+            hmmsearch_db(bait + ".hmm", db, nt)
+            hits = parse_hmmsearch_out(db + ".out", nhits, max_evalue,
+                                       min_score)
+            os.remove(db + ".out")
+            cache_put(cache_dir, key, [db + ".tbl"])
+    gather_sequences(hits, db, outfile, nhits, store)
+    os.remove(hits)
+    return outfile
+
+
+def search_dbs(bait, dblist, outfile, blast=False, nhits=None, nt=1,
+               min_bitscore=30.0, thresh=0.1, jobs=1, store=None,
+               cache_dir=None, baitkey=None, max_evalue=None, min_score=None,
+               per_query=None, manifest={}, prefilter=None, executor=None):
+    """Search each proteome in dblist, writing hits to outfile in dblist
+    order. With jobs > 1 or a spool:DIR executor, proteomes are searched
+    concurrently, largest first, splitting nt threads between the jobs. If
+    cache_dir is given, hits are cached under the bait key, the proteome
+    checksum and the search parameters. Checksums and residue counts are
+    taken from the manifest of prepared DBs where available"""
+    keys = {db: None for db in dblist}
+    if cache_dir is not None:
+        digests = {db: manifest[db]["sha256"] for db in dblist
+                   if db in manifest}
+        digests.update(file_digests([db for db in dblist
+                                     if db not in digests], cache_dir))
+        for db, digest in digests.items():
+            if blast:
+                parts = [baitkey, digest, blast, min_bitscore, thresh,
+                         per_query]
+            else:
+                parts = [baitkey, digest, "tblout"]
+            if prefilter is not None:
+                parts.append(prefilter)
+            keys[db] = make_key(*parts)
+    jobs, jobnt = split_threads(nt, jobs)
+    if jobs == 1 and executor in (None, "local"):
+        for db in dblist:
+            search_db(bait, db, outfile, blast, nhits, int(nt), min_bitscore,
+                      thresh, store, cache_dir, keys[db], max_evalue,
+                      min_score, per_query, prefilter)
+        if not blast:
+            write_run_table(dblist, outfile[:-2] + "tsv")
+        return outfile
+    logging.info(f"searching {jobs} sequence DBs at once with {jobnt} "
+                 f"thread(s) each")
+    parts = {db: outfile + "." + os.path.basename(db) + ".part"
+             for db in dblist}
+    for part in parts.values():
+        if os.path.isfile(part):
+            os.remove(part)
+    sizes = {db: manifest[db]["nres"] if db in manifest
+             else count_residues(db) for db in dblist}
+    with get_executor(executor, jobs) as pool:
+        futures = [pool.submit(search_db, bait, db, parts[db], blast, nhits,
+                               jobnt, min_bitscore, thresh, store,
+                               cache_dir, keys[db], max_evalue, min_score,
+                               per_query, prefilter)
+                   for db in sorted(dblist, key=lambda x: sizes[x],
+                                    reverse=True)]
+        for fut in futures:
+            fut.result()
+    with open(outfile, "a") as outf:  # merge in dblist order
+        for db in dblist:
+            if os.path.isfile(parts[db]):
+                with open(parts[db], "r") as inf:
+                    shutil.copyfileobj(inf, outf)
+                os.remove(parts[db])
+    if not blast:
+        write_run_table(dblist, outfile[:-2] + "tsv")
+    return outfile
+
+
+def append_baits(bait, outfile):
+    baitdict = dict([x for x in parse_fasta(bait)])
+    with open(outfile, "a") as outf:  # append baits back to search results
+        for key, value in baitdict.items():
+            outf.write(">" + key + "\n")
+            outf.write(value + "\n")
+    return outfile
+
+
+def collect_dbs(database_dir, dbkeep=None):
+    """Return the sequence DBs in database_dir to search, optionally only
+    those in dbkeep, and write their names to database.txt"""
     # collect individual sequence sets
     dblist = []
     outf = open("database.txt", "w")
@@ -147,7 +696,7 @@ def search_proteomes(bait, database_dir, output_dir, blast=False, nhits=None,
     #                 outf.write(f"{f}\n")
 
     dirpath = next(os.walk(database_dir))[0]
-    for f in os.listdir(database_dir):
+    for f in sorted(os.listdir(database_dir)):
         if f.endswith(".pep.fa") or f.endswith(".cdhit"):  # add suffix
             if dbkeep is not None:
                     if f in dbkeep:
@@ -165,30 +714,60 @@ def search_proteomes(bait, database_dir, output_dir, blast=False, nhits=None,
         logging.info(f"searching {len(dblist)} sequence DBs "
                                  f"in {database_dir}")
     logging.info("writing DBs to database.txt")
+    return dblist
+
+
+def search_proteomes(bait, database_dir, output_dir, blast=False, nhits=None,
+                     nt=1, min_bitscore=30.0, thresh=0.1, dbkeep=None,
+                     jobs=1, merged=False, store=None, cache_dir=None,
+                     cache_size=10.0, max_evalue=None, min_score=None,
+                     per_query=None, prefilter=None, executor=None):
+    # file name
+    if "/" in bait:
+        name = bait.split("/")[-1].split(".")[0]
+    else:
+        name = bait.split(".")[0]
+
+    dblist = collect_dbs(database_dir, dbkeep)
+    manifest = read_manifest(database_dir)
+    if manifest:
+        logging.info(f"{len(set(dblist) & set(manifest))} of {len(dblist)} "
+                     f"sequence DBs prepared in manifest")
 
     if blast:
         logging.info("using blastp")
         outfile = os.path.abspath(output_dir) + "/" + name + ".blastp.fa"
         if os.path.isfile(outfile):
             os.remove(outfile)  # prevent appending partial file
-        for db in dblist:
-            blastdbsuf = [".pdb", ".phr", ".pin", ".pog", ".pos", ".pot",
-                          ".psq", ".ptf", ".pto"]
-            for s in blastdbsuf:
-                if not os.path.isfile(db + s):
-                    make_blast_db(db)
-            blastout = blast_db(bait, db, nt)
-            hits = parse_blastp_out(blastout, min_bitscore, thresh)
-            gather_sequences(hits, db, outfile, nhits)
-            os.remove(blastout)
-            os.remove(hits)
+        if cache_dir is not None:
+            baitkey = make_key("blastp", file_digest(bait))
+        else:
+            baitkey = None
+        if merged:
+            search_merged_db(bait, dblist, database_dir, outfile, True, nhits,
+                             nt, min_bitscore, thresh, store, cache_dir,
+                             baitkey, per_query=per_query)
+        else:
+            search_dbs(bait, dblist, outfile, True, nhits, nt, min_bitscore,
+                       thresh, jobs, store, cache_dir, baitkey,
+                       per_query=per_query, manifest=manifest,
+                       prefilter=prefilter, executor=executor)
     else:
         logging.info("using hmmsearch")
         outfile = os.path.abspath(output_dir) + "/" + name + ".hmmsearch.fa"
         if os.path.isfile(outfile):
             os.remove(outfile)  # prevent appending partial file
         stockholm = bait + ".sto"
-        if stockholm not in os.listdir(os.getcwd()):
+        baitkey = None
+        if cache_dir is not None:
+            baitkey = make_key("fsa --fast", "hmmbuild", file_digest(bait))
+            if cache_get(cache_dir, baitkey, [stockholm, bait + ".hmm"]):
+                logging.info(f"using cached alignment and hmm for {bait}")
+            else:
+                fasta_to_stockholm(bait)
+                stockholm_to_profile(stockholm)
+                cache_put(cache_dir, baitkey, [stockholm, bait + ".hmm"])
+        elif stockholm not in os.listdir(os.getcwd()):
             fasta_to_stockholm(bait)
             stockholm_to_profile(stockholm)
         else:
@@ -197,21 +776,66 @@ def search_proteomes(bait, database_dir, output_dir, blast=False, nhits=None,
             except subprocess.CalledProcessError:
                 fasta_to_stockholm(bait)
                 stockholm_to_profile(stockholm)
-        for db in dblist:
-            hmmsearch_db(bait + ".hmm", db)
-            parse_hmmsearch_out(db + ".out")
-            gather_sequences(db + ".hits", db,
-                             outfile,
-                             nhits=nhits)
-            os.remove(db + ".out")
-            os.remove(db + ".hits")
+        if merged:
+            search_merged_db(bait, dblist, database_dir, outfile, False,
+                             nhits, nt, store=store, cache_dir=cache_dir,
+                             baitkey=baitkey, max_evalue=max_evalue,
+                             min_score=min_score)
+        else:
+            search_dbs(bait, dblist, outfile, False, nhits, nt, jobs=jobs,
+                       store=store, cache_dir=cache_dir, baitkey=baitkey,
+                       max_evalue=max_evalue, min_score=min_score,
+                       manifest=manifest, prefilter=prefilter,
+                       executor=executor)
+
+    evict(cache_dir, int(cache_size * 1e9))
+
+    return append_baits(bait, outfile)
 
-    baitdict = dict([x for x in parse_fasta(bait)])
-    with open(outfile, "a") as outf:  # append baits back to search results
-        for key, value in baitdict.items():
-            outf.write(">" + key + "\n")
-            outf.write(value + "\n")
-    return outfile
+
+def search_proteomes_batch(baits, database_dir, output_dir, nhits=None, nt=1,
+                           dbkeep=None, store=None):
+    """Search for several bait families at once, scanning each proteome a
+    single time against the HMMs of all families with hmmscan. Writes a
+    .hmmsearch.fa per family and returns a dict of family: output file"""
+    families = {}
+    for bait in baits:
+        fam = bait.split("/")[-1].split(".")[0]
+        if fam in families:
+            sys.stderr.write(f"bait files {families[fam]} and {bait} give "
+                             f"the same family name {fam}\n")
+            sys.exit()
+        families[fam] = bait
+    dblist = collect_dbs(database_dir, dbkeep)
+    logging.info(f"scanning with hmms of {len(families)} bait families")
+
+    hmmdb = os.path.abspath(output_dir) + "/batch.hmm"
+    with open(hmmdb, "w") as outf:
+        for fam, bait in families.items():
+            fasta_to_stockholm(bait)
+            stockholm_to_profile(bait + ".sto", fam)
+            with open(bait + ".hmm", "r") as inf:
+                shutil.copyfileobj(inf, outf)
+    cmd = ["hmmpress", "-f", hmmdb]
+    runner.run(cmd)
+
+    outfiles = {}
+    for fam in families:
+        outfiles[fam] = (os.path.abspath(output_dir) + "/" + fam +
+                         ".hmmsearch.fa")
+        if os.path.isfile(outfiles[fam]):
+            os.remove(outfiles[fam])  # prevent appending partial file
+    for db in dblist:
+        hmmscan_db(hmmdb, db, nt)
+        hitsfiles = parse_hmmscan_out(db + ".scan.out", families)
+        for fam, hits in hitsfiles.items():
+            gather_sequences(hits, db, outfiles[fam], nhits, store)
+            os.remove(hits)
+        os.remove(db + ".scan.out")
+
+    for fam, bait in families.items():
+        append_baits(bait, outfiles[fam])
+    return outfiles
 
 
 if __name__ == "__main__":
@@ -237,20 +861,89 @@ if __name__ == "__main__":
                         default=1)
     parser.add_argument("-dbl", "--dblist", help="Text file with files in \
                         database_dir to to search, if not all, one per line")
+    parser.add_argument("-j", "--jobs", help="Number of sequence DBs to \
+                        search at once, sharing --threads between them \
+                        (default 1)", type=int, default=1)
+    parser.add_argument("-md", "--merged", help="Search a single merged DB \
+                        of all sequence DBs instead of one at a time, \
+                        applying --keep per taxon", action="store_true")
+    parser.add_argument("-s", "--store", help="Take hit sequences from an \
+                        sqlite sequence store of database_dir, building or \
+                        updating it first", action="store_true")
+    parser.add_argument("-sp", "--store_path", help="Path to the sequence \
+                        store (default database_dir/seqstore.sqlite)",
+                        default=None)
+    parser.add_argument("--per_query", help="For blast. Keep at most this \
+                        many hits of each query (default all)", type=int,
+                        default=None)
+    parser.add_argument("--max_evalue", help="For hmmsearch. Filter hits \
+                        with E-value higher than max_evalue", type=float,
+                        default=None)
+    parser.add_argument("--min_score", help="For hmmsearch. Filter hits with \
+                        bitscore lower than min_score", type=float,
+                        default=None)
+    parser.add_argument("--from_table", help="For hmmsearch. Rebuild the hits \
+                        FASTA from the .hmmsearch.tsv hit table of a previous \
+                        run with new --keep, --max_evalue and --min_score, \
+                        without searching again", action="store_true")
+    parser.add_argument("-pf", "--prefilter", help="Only search sequences \
+                        sharing at least this many reduced-alphabet k-mers \
+                        with the baits (requires numpy, may miss remote \
+                        homologs)", type=int, default=None)
+    parser.add_argument("--kmer", help="k-mer length for --prefilter \
+                        (default 5)", type=int, default=5)
+    parser.add_argument("-c", "--cache_dir", help="Directory to cache bait \
+                        HMMs and per-DB hits in, reused by later runs",
+                        default=None)
+    parser.add_argument("-cs", "--cache_size", help="Size in GB to trim the \
+                        cache to after searching (default 10)", type=float,
+                        default=10.0)
+    parser.add_argument("--timeout", help="Seconds after which to kill an \
+                        external program (default none)", type=float,
+                        default=None)
+    parser.add_argument("-e", "--executor", help="Where to run concurrent \
+                        searches: local (default) or spool:DIR to queue them \
+                        in DIR for executor.py workers", default=None)
     # parser.add_argument("")
     args = parser.parse_args()
 
+    runner.configure(args.timeout)
+
     # _ = search_proteomes(args.bait, args.database_dir, args.output_dir,
     #                      blast=False, nhits=args.keep)
-    if args.dblist is not None:
+    if args.store:
+        STORE = build_store(args.database_dir, args.store_path)
+    else:
+        STORE = None
+    if args.prefilter is not None:
+        PREFILTER = (args.kmer, args.prefilter)
+    else:
+        PREFILTER = None
+    if args.from_table:
+        outfile = (os.path.abspath(args.output_dir) + "/" +
+                   args.bait.split("/")[-1].split(".")[0] + ".hmmsearch.fa")
+        hits_from_table(outfile[:-2] + "tsv", outfile, args.keep,
+                        args.max_evalue, args.min_score, STORE)
+        append_baits(args.bait, outfile)
+    elif args.dblist is not None:
         DBLIST = []
         with open(args.dblist, "r") as f:
             for line in f:
                 DBLIST.append(line.strip())
         _ = search_proteomes(args.bait, args.database_dir, args.output_dir,
                              args.blast, args.keep, args.threads,
-                             args.min_bitscore, args.threshold, DBLIST)
+                             args.min_bitscore, args.threshold, DBLIST,
+                             args.jobs, args.merged, STORE, args.cache_dir,
+                             args.cache_size, args.max_evalue, args.min_score,
+                             args.per_query, PREFILTER, args.executor)
     else:
         _ = search_proteomes(args.bait, args.database_dir, args.output_dir,
                              args.blast, args.keep, args.threads,
-                             args.min_bitscore, args.threshold)
+                             args.min_bitscore, args.threshold,
+                             jobs=args.jobs, merged=args.merged,
+                             store=STORE, cache_dir=args.cache_dir,
+                             cache_size=args.cache_size,
+                             max_evalue=args.max_evalue,
+                             min_score=args.min_score,
+                             per_query=args.per_query, prefilter=PREFILTER,
+                             executor=args.executor)
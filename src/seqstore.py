@@ -0,0 +1,101 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import sqlite3
+import argparse
+import logging
+from utils import parse_fasta
+
+
+def open_store(store):
+    """Open (creating if needed) an sqlite sequence store"""
+    con = sqlite3.connect(store, timeout=60)
+    con.execute("CREATE TABLE IF NOT EXISTS sources "
+                "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)")
+    con.execute("CREATE TABLE IF NOT EXISTS seqs "
+                "(name TEXT, source TEXT, seq TEXT)")
+    con.execute("CREATE INDEX IF NOT EXISTS seqs_name ON seqs (name)")
+    con.execute("CREATE INDEX IF NOT EXISTS seqs_source ON seqs (source)")
+    return con
+
+
+def build_store(database_dir, store=None, suffixes=(".pep.fa", ".cdhit")):
+    """Load every sequence DB in database_dir ending with one of suffixes
+    into an sqlite store (default database_dir/seqstore.sqlite). Only DBs
+    added or changed since the last build are parsed, and DBs ending with
+    one of suffixes no longer in database_dir are dropped. Returns the path
+    to the store"""
+    if store is None:
+        store = os.path.join(database_dir, "seqstore.sqlite")
+    dbs = {}
+    for f in sorted(os.listdir(database_dir)):
+        if f.endswith(suffixes):
+            path = os.path.abspath(os.path.join(database_dir, f))
+            st = os.stat(path)
+            dbs[path] = (st.st_size, st.st_mtime_ns)
+    con = open_store(store)
+    with con:
+        known = {path: (size, mtime) for path, size, mtime in
+                 con.execute("SELECT path, size, mtime FROM sources")}
+        for path in known:
+            if path not in dbs and path.endswith(suffixes):
+                logging.info(f"dropping {path} from sequence store {store}")
+                con.execute("DELETE FROM seqs WHERE source = ?", (path,))
+                con.execute("DELETE FROM sources WHERE path = ?", (path,))
+        for path, stamp in dbs.items():
+            if known.get(path) == stamp:
+                continue
+            sys.stderr.write(f"Adding {path} to sequence store\n")
+            logging.info(f"adding {path} to sequence store {store}")
+            con.execute("DELETE FROM seqs WHERE source = ?", (path,))
+            con.executemany("INSERT INTO seqs VALUES (?, ?, ?)",
+                            ((name, path, seq) for name, seq in
+                             parse_fasta(path)))
+            con.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                        (path,) + stamp)
+    con.close()
+    return store
+
+
+def get_sequence_dict(store, names):
+    """Return a dict of name: sequence for those names found in the store"""
+    names = list(names)
+    found = {}
+    con = open_store(store)
+    for i in range(0, len(names), 500):  # stay under sqlite variable limit
+        chunk = names[i:i + 500]
+        query = ("SELECT name, seq FROM seqs WHERE name IN (" +
+                 ",".join("?" * len(chunk)) + ")")
+        for name, seq in con.execute(query, chunk):
+            found.setdefault(name, seq)
+    con.close()
+    return found
+
+
+def get_sequences(store, names):
+    """Given a path to a sequence store and an iterable of names, returns an
+    iterator which yields a (name, sequence) tuple in the order requested.
+    Raises KeyError for names not in the store"""
+    names = list(names)
+    found = get_sequence_dict(store, names)
+    for name in names:
+        yield name, found[name]
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_dir", help="Directory containing sequence \
+                        DBs to load into the store")
+    parser.add_argument("-s", "--store", help="Path to the store (default \
+                        database_dir/seqstore.sqlite)", default=None)
+    parser.add_argument("--suffixes", help="Comma-separated file endings of \
+                        sequence DBs to load (default .pep.fa,.cdhit)",
+                        default=".pep.fa,.cdhit")
+    args = parser.parse_args()
+
+    build_store(args.database_dir, args.store,
+                tuple(args.suffixes.split(",")))
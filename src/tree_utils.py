@@ -33,6 +33,19 @@ def get_clusterID(filename):
     return filename.split(".")[0]
 
 
+def write_tree(node, outfile):
+    """Write a tree to outfile in newick format"""
+    with open(outfile, "w") as outf:
+        outf.write(newick3.tostring(node)+";\n")
+
+
+def read_tree(infile, node_class=phylo3.CompactNode):
+    """Parse the first tree in a newick file, into compact nodes unless
+    another node_class is given"""
+    with open(infile, "r") as inf:
+        return newick3.parse(inf.readline(), node_class=node_class)
+
+
 def get_front_labels(node):
     """given a node, return a list of front tip labels"""
     leaves = node.leaves()
@@ -185,7 +198,7 @@ def extract_rooted_ingroup_clades(root, ingroups, outgroups, min_ingroup_taxa):
             if direction == "front":
                 inclades.append(max_node)
                 kink = max_node.prune()
-                if len(root.leaves()) > 3:
+                if root.ntips() > 3:
                     newnode, root = remove_kink(kink, root)
                 else:
                     break
@@ -194,7 +207,7 @@ def extract_rooted_ingroup_clades(root, ingroups, outgroups, min_ingroup_taxa):
                 par.remove_child(max_node)
                 max_node.prune()
                 inclades.append(phylo3.reroot(root, par))  # flip dirction
-                if len(max_node.leaves()) > 3:
+                if max_node.ntips() > 3:
                     max_node, root = remove_kink(max_node, max_node)
                 else:
                     break
@@ -268,7 +281,7 @@ def extract_rooted_ingroup_clades_with_outgroup(root, ingroups, outgroups,
                             og = False
                 #
                 kink = max_node.prune()
-                if len(root.leaves()) > 3:
+                if root.ntips() > 3:
                     newnode, root = remove_kink(kink, root)
                 else:
                     break
@@ -278,7 +291,7 @@ def extract_rooted_ingroup_clades_with_outgroup(root, ingroups, outgroups,
                 par.remove_child(max_node)
                 max_node.prune()
                 inclades.append(phylo3.reroot(root, par))  # flip dirction
-                if len(max_node.leaves()) > 3:
+                if max_node.ntips() > 3:
                     max_node, root = remove_kink(max_node, max_node)
                 else:
                     break
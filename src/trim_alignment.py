@@ -0,0 +1,63 @@
+#! /usr/bin/python3
+
+import sys
+import argparse
+import logging
+import numpy as np
+from utils import parse_fasta
+
+# characters not counted as data, as in mask_monophyly
+MISSING = np.frombuffer(b"-Xx?*", dtype=np.uint8)
+
+
+def read_alignment(aln):
+    """Read an aligned fasta into a list of names and a uint8 matrix with a
+    row per sequence"""
+    names, seqs = [], []
+    for name, seq in parse_fasta(aln):
+        names.append(name)
+        seqs.append(seq)
+    if not seqs:  # no rows or columns
+        return names, np.zeros((0, 0), dtype=np.uint8)
+    ncol = len(seqs[0])
+    if any(len(s) != ncol for s in seqs):
+        raise ValueError(f"sequences in {aln} are not all the same length")
+    matrix = np.frombuffer("".join(seqs).encode(), dtype=np.uint8)
+    return names, matrix.reshape(len(seqs), ncol)
+
+
+def trim_alignment(aln, out, min_occupancy=0.1):
+    """Remove columns of aln with less than min_occupancy proportion of
+    unambiguous characters, like pxclsq -p, and write the result to out.
+    Returns a dict of the number of unambiguous characters per sequence in
+    the trimmed alignment"""
+    names, matrix = read_alignment(aln)
+    if not names:
+        open(out, "w").close()
+        logging.info(f"no sequences in {aln} to trim")
+        return {}
+    present = ~np.isin(matrix, MISSING)
+    keep = present.mean(axis=0) >= min_occupancy
+    counts = present[:, keep].sum(axis=1)
+    trimmed = matrix[:, keep]
+    with open(out, "w") as outf:
+        for name, row in zip(names, trimmed):
+            outf.write(">" + name + "\n")
+            outf.write(row.tobytes().decode() + "\n")
+    logging.info(f"kept {int(keep.sum())} of {matrix.shape[1]} columns")
+    return dict(zip(names, counts.tolist()))
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("aln", help="Alignment in FASTA format to trim")
+    parser.add_argument("out", help="File to write trimmed alignment to")
+    parser.add_argument("-p", "--prop", help="Minimum proportion of \
+                        unambiguous characters to keep a column (default \
+                        0.1)", type=float, default=0.1)
+    args = parser.parse_args()
+
+    _ = trim_alignment(args.aln, args.out, args.prop)
@@ -3,7 +3,6 @@
 import sys
 import os
 import argparse
-import newick3
 import logging
 from tree_utils import *
 
@@ -24,7 +23,7 @@ def check_countrast_outlier(node0, node1, above0, above1, relative_cutoff):
 # from Y. Yang https://bitbucket.org/yangya/adh_2016/src/master/trim_tips.py
 def remove_a_tip(root, tip_node):
     node = tip_node.prune()
-    if len(root.leaves()) > 3:
+    if root.ntips() > 3:
         node, root = remove_kink(node, root)
         return root
     else:
@@ -36,7 +35,7 @@ def trim(curroot, relative_cutoff, absolute_cutoff):
     if curroot.nchildren == 2:
         temp, root = remove_kink(curroot, curroot)
     going = True
-    while going and curroot is not None and len(curroot.leaves()) > 3:
+    while going and curroot is not None and curroot.ntips() > 3:
         going = False
         for i in curroot.iternodes(order=1):  # POSTORDER
             if i.nchildren == 0:  # at the tip
@@ -90,19 +89,24 @@ def trim(curroot, relative_cutoff, absolute_cutoff):
     return curroot
 
 
-def trim_tree(inf, relative_cut=1.0, absolute_cut=1.5):
-    with open(inf, "r") as infile:
-        intree = newick3.parse(infile.readline())
-    in_tips = len(intree.leaves())
+def trim_tree_node(intree, relative_cut=1.0, absolute_cut=1.5, name="tree"):
+    """Trim long tips from a parsed tree in place, returning its root.
+    name is the tree's file, for logging"""
+    in_tips = intree.ntips()
     outtree = trim(intree, float(relative_cut), float(absolute_cut))
-    out_tips = len(outtree.leaves())
+    out_tips = outtree.ntips()
+    logging.info(f"trimming tips in {name} longer than {absolute_cut}"
+                 f"or >10x length of sister and longer than {relative_cut}")
+    logging.info(f"trimmed {in_tips - out_tips} tip(s)")
+    return outtree
+
+
+def trim_tree(inf, relative_cut=1.0, absolute_cut=1.5):
+    outtree = trim_tree_node(read_tree(inf), relative_cut, absolute_cut, inf)
     # if outtree is not None:
     out = inf + ".tt"
-    logging.info(f"trimming tips in {inf} longer than {absolute_cut}"
-                 f"or >10x length of sister and longer than {relative_cut}")
-    logging.info(f"trimmed {in_tips - out_tips} tip(s), writing to {out}")
-    with open(out, "w") as outfile:
-        outfile.write(newick3.tostring(outtree)+";\n")
+    logging.info(f"writing to {out}")
+    write_tree(outtree, out)
     return out
 
 
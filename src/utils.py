@@ -2,6 +2,7 @@
 
 import sys
 import os
+import tempfile
 
 
 # courtesy of Jonathan Chang https://gist.github.com/jonchang/6471846
@@ -22,3 +23,72 @@ def parse_fasta(path):
         # yield the last sequence
         if name and sequence:
             yield name, sequence
+
+
+def index_fasta(path):
+    """Build a byte-offset index of a fasta file. Returns a dict of
+    name: (offset, nbytes) where offset is the start of the sequence lines
+    and nbytes their length in bytes, including newlines. The index is
+    written to path + ".idx", headed by the size and mtime of the fasta so a
+    stale index can be detected. It is written to a temporary file first
+    and moved into place, so other runs never read a partial index"""
+    index = {}
+    st = os.stat(path)
+    with open(path, "rb") as handle:
+        name = None
+        start = offset = 0
+        for line in handle:
+            if line.startswith(b">"):
+                if name is not None:
+                    index[name] = (start, offset - start)
+                name = line[1:].strip().decode()
+                start = offset + len(line)
+            offset += len(line)
+        if name is not None:
+            index[name] = (start, offset - start)
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                   suffix=".idx.tmp",
+                                   dir=os.path.dirname(path) or ".")
+        os.fchmod(fd, 0o644)  # mkstemp makes it private; others read it too
+        with os.fdopen(fd, "w") as outf:
+            outf.write(f"#{st.st_size}\t{st.st_mtime_ns}\n")
+            for name, (start, nbytes) in index.items():
+                outf.write(f"{name}\t{start}\t{nbytes}\n")
+        os.replace(tmp, path + ".idx")
+    except OSError:
+        sys.stderr.write(f"unable to write index for {path}\n")
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    return index
+
+
+def load_fasta_index(path):
+    """Return the byte-offset index of a fasta file, rebuilding it if it is
+    missing or the fasta has changed since it was written"""
+    idx = path + ".idx"
+    if os.path.isfile(idx):
+        st = os.stat(path)
+        with open(idx, "r") as inf:
+            if inf.readline() == f"#{st.st_size}\t{st.st_mtime_ns}\n":
+                index = {}
+                for line in inf:
+                    name, start, nbytes = line.rstrip("\n").split("\t")
+                    index[name] = (int(start), int(nbytes))
+                return index
+    return index_fasta(path)
+
+
+def fetch_sequences(path, names):
+    """Given a path to a fasta file and an iterable of sequence names, seeks
+    to each record using the offset index. Returns an iterator which yields
+    a (name, sequence) tuple in the order requested. Raises KeyError for
+    names not in the file"""
+    index = load_fasta_index(path)
+    with open(path, "rb") as handle:
+        for name in names:
+            start, nbytes = index[name]
+            handle.seek(start)
+            sequence = b"".join(handle.read(nbytes).split())
+            yield name, sequence.decode()
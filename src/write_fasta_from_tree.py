@@ -3,22 +3,34 @@
 import sys
 import os
 import argparse
-import newick3
-from utils import parse_fasta
+from utils import fetch_sequences
+from seqstore import get_sequence_dict
 import tree_utils
 
 
-def write_fasta_from_tree(allfa, tree):
-    tree = os.path.abspath(tree)
-    name = tree.split("/")[-1].split(".")[0]
-    fa_dict = dict([x for x in parse_fasta(allfa)])
-    with open(tree, "r") as inf:
-        t = newick3.parse(inf.readline())
+def write_fasta_from_tree(allfa, tree, store=None, treefile=None):
+    """Write the sequences of the tips of tree to a fasta named from the
+    tree file. tree is either a newick file or a parsed tree, with treefile
+    the file it is or would be written to. Sequences are taken from the
+    sequence store if given, falling back to allfa for any not in it (e.g.
+    baits)"""
+    if isinstance(tree, str):
+        treefile = tree
+        t = tree_utils.read_tree(tree)
+    else:
+        t = tree
+    treefile = os.path.abspath(treefile)
+    name = treefile.split("/")[-1].split(".")[0]
     seqids = set(tree_utils.get_front_labels(t))
+    if store is not None:
+        seqs = get_sequence_dict(store, seqids)
+    else:
+        seqs = {}
+    seqs.update(fetch_sequences(allfa, seqids - set(seqs)))
     with open(name+".pep.fa", "w") as outf:
         for s in seqids:
             outf.write(">"+s+"\n")
-            outf.write(fa_dict[s]+"\n")
+            outf.write(seqs[s]+"\n")
     return name+".pep.fa"
 
 
@@ -31,6 +43,8 @@ if __name__ == "__main__":
                         fasta from tips")
     parser.add_argument("allfasta", help="Master FASTA containing sequences \
                         to be written")
+    parser.add_argument("-s", "--store", help="sqlite sequence store to take \
+                        sequences from before allfasta", default=None)
     args = parser.parse_args()
 
-    write_fasta_from_tree(args.allfasta, args.intree)
+    write_fasta_from_tree(args.allfasta, args.intree, args.store)
@@ -0,0 +1,20 @@
+from itertools import combinations
+from bait_homologs import allot_threads
+
+
+def test_allot_threads_by_size_when_nt_divides_by_jobs():
+    sizes = {"big.fa": 300, "small.fa": 100, "tiny.fa": 5}
+    threads = allot_threads(sizes, 8, 2)
+    assert threads["big.fa"] > threads["small.fa"] >= threads["tiny.fa"] >= 1
+    for pair in combinations(sizes, 2):
+        assert sum(threads[f] for f in pair) <= 8
+
+
+def test_allot_threads_equal_sizes_split_evenly():
+    assert allot_threads({"a.fa": 10, "b.fa": 10}, 8, 2) == {"a.fa": 4,
+                                                              "b.fa": 4}
+
+
+def test_allot_threads_one_job_at_a_time_gets_all_threads():
+    assert allot_threads({"a.fa": 10, "b.fa": 1}, 6, 1) == {"a.fa": 6,
+                                                             "b.fa": 6}
@@ -0,0 +1,18 @@
+import math
+import threading
+import executor
+
+
+def test_spool_executor_resolves_jobs_submitted_as_collector_exits(tmp_path):
+    spool = str(tmp_path / "spool")
+    ex = executor.SpoolExecutor(spool, poll=0.001)
+    worker = threading.Thread(target=executor.work, args=(spool, 0.001, 5),
+                              daemon=True)
+    worker.start()
+    with ex:
+        for i in range(50):
+            # each job is submitted as the collector of the last one stops
+            assert ex.submit(math.sqrt, i * i).result(timeout=5) == i
+        futs = [ex.submit(math.sqrt, i * i) for i in range(20)]
+    assert [f.result(timeout=0) for f in futs] == list(range(20))
+    assert ex.collector is None
@@ -0,0 +1,51 @@
+import random
+import newick3
+from fasta_to_tree import prune_start_tree
+
+
+def random_newick(rng, labels):
+    """A random bifurcating tree of labels with random branch lengths"""
+    nodes = [f"{x}:{rng.random():.3f}" for x in labels]
+    while len(nodes) > 3:
+        a, b = sorted(rng.sample(range(len(nodes)), 2), reverse=True)
+        pair = [nodes.pop(a), nodes.pop(b)]
+        nodes.append(f"({pair[0]},{pair[1]}):{rng.random():.3f}")
+    return "(" + ",".join(nodes) + ");"
+
+
+def path_length(tree, a, b):
+    up = {}
+    dist, node = 0.0, tree.find_descendant(a)
+    while node is not None:
+        up[id(node)] = dist
+        dist += node.length or 0.0
+        node = node.parent
+    dist, node = 0.0, tree.find_descendant(b)
+    while id(node) not in up:
+        dist += node.length or 0.0
+        node = node.parent
+    return dist + up[id(node)]
+
+
+def test_prune_start_tree_leaves_no_single_child_nodes(tmp_path):
+    rng = random.Random(1)
+    labels = [f"t{i}" for i in range(10)]
+    for i in range(100):
+        newick = random_newick(rng, labels)
+        names = rng.sample(labels, rng.randint(3, 9))
+        intree = tmp_path / f"{i}.tre"
+        intree.write_text(newick + "\n")
+        aln = tmp_path / f"{i}.aln"
+        aln.write_text("".join(f">{x}\nMKV\n" for x in names))
+        with open(prune_start_tree(str(intree), str(aln)), "r") as f:
+            pruned = newick3.parse(f.readline())
+        assert sorted(x.label for x in pruned.leaves()) == sorted(names)
+        for node in pruned.iternodes():
+            if not node.istip:
+                assert node.nchildren >= 2
+        full = newick3.parse(newick)
+        for a in names:
+            for b in names:
+                if a < b:
+                    assert abs(path_length(pruned, a, b) -
+                               path_length(full, a, b)) < 1e-9
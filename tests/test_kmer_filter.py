@@ -0,0 +1,25 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+from kmer_filter import prefilter  # noqa: E402
+
+
+def test_prefilter_keeps_sequences_sharing_kmers(tmp_path):
+    bait = tmp_path / "bait.fa"
+    bait.write_text(">b\nMKVLLAG\n")
+    db = tmp_path / "A.pep.fa"
+    db.write_text(">A@1\nMKVLLAGW\n>A@2\nPPPPPPP\n")
+    out = tmp_path / "out.fa"
+    assert prefilter(str(bait), str(db), str(out)) == (1, 2)
+    assert out.read_text() == ">A@1\nMKVLLAGW\n"
+
+
+def test_prefilter_empty_db(tmp_path):
+    bait = tmp_path / "bait.fa"
+    bait.write_text(">b\nMKVLLAG\n")
+    db = tmp_path / "A.pep.fa"
+    db.write_text("")
+    out = tmp_path / "out.fa"
+    for _ in range(2):  # building the index, then reading it back
+        assert prefilter(str(bait), str(db), str(out)) == (0, 0)
+        assert out.read_text() == ""
@@ -0,0 +1,17 @@
+import newick3
+from phylo3 import CompactNode, Node
+
+
+def test_to_string_round_trip():
+    s = "((a:0.1,b:0.2)90:0.3,c:0.4,(d:1.5,e:0.0):2.0)"
+    for node_class in (Node, CompactNode):
+        assert newick3.tostring(newick3.parse(s + ";",
+                                              node_class=node_class)) == \
+            s + ":0"
+
+
+def test_to_string_default_root_length():
+    # a root without a branch length has the default length of 0
+    for node_class in (Node, CompactNode):
+        tree = newick3.parse("(a:0.1,b:0.2,c:0.3);", node_class=node_class)
+        assert newick3.tostring(tree) == "(a:0.1,b:0.2,c:0.3):0"
@@ -0,0 +1,58 @@
+import search_proteomes
+from search_proteomes import parse_blastp_out
+
+
+def write_blastp_out(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write("\t".join(str(x) for x in row) + "\n")
+    return str(path)
+
+
+def read_hits(path):
+    with open(path, "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def test_parse_blastp_out_counts_subjects_not_hsps(tmp_path):
+    outf = write_blastp_out(tmp_path / "db.blastp.outfmt6",
+                            [("q1", "A@1", 1e-50, 200.0),
+                             ("q1", "A@1", 1e-40, 150.0),
+                             ("q1", "A@2", 1e-20, 100.0)])
+    hits = parse_blastp_out(outf, per_query=2)
+    assert read_hits(hits) == ["A@1", "A@2"]
+
+
+def test_parse_blastp_out_per_query_cap(tmp_path):
+    outf = write_blastp_out(tmp_path / "db.blastp.outfmt6",
+                            [("q1", "A@1", 1e-50, 200.0),
+                             ("q1", "A@2", 1e-40, 150.0),
+                             ("q1", "A@2", 1e-45, 180.0),
+                             ("q1", "A@3", 1e-20, 100.0),
+                             ("q2", "A@3", 1e-30, 120.0)])
+    hits = parse_blastp_out(outf, per_query=2)
+    assert read_hits(hits) == ["A@1", "A@2", "A@3"]
+
+
+def test_merged_blastp_reports_every_target(tmp_path, monkeypatch):
+    db_dir = tmp_path / "pep"
+    db_dir.mkdir()
+    (db_dir / "A.pep.fa").write_text(">A@1\nMKV\n>A@2\nMKVL\n")
+    (db_dir / "B.pep.fa").write_text(">B@1\nMKVLL\n")
+    dblist = [str(db_dir / "A.pep.fa"), str(db_dir / "B.pep.fa")]
+    bait = tmp_path / "bait.pep.fa"
+    bait.write_text(">q1\nMKVLL\n")
+    cmds = []
+
+    def run(cmd, **kwargs):
+        cmds.append(cmd)
+        if "-out" in cmd:
+            open(cmd[cmd.index("-out") + 1], "w").close()
+    monkeypatch.setattr(search_proteomes.runner, "run", run)
+    search_proteomes.search_merged_db(str(bait), dblist, str(db_dir),
+                                      str(tmp_path / "bait.blastp.fa"),
+                                      blast=True)
+    blastp = [cmd for cmd in cmds if cmd[0] == "blastp"]
+    assert len(blastp) == 1
+    cmd = blastp[0]
+    assert int(cmd[cmd.index("-max_target_seqs") + 1]) >= 3
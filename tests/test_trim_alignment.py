@@ -0,0 +1,21 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+from trim_alignment import trim_alignment  # noqa: E402
+
+
+def test_trim_alignment_drops_sparse_columns(tmp_path):
+    aln = tmp_path / "x.aln"
+    aln.write_text(">a\nMK-V\n>b\nM--V\n>c\nMK--\n")
+    out = tmp_path / "x.aln-cln"
+    assert trim_alignment(str(aln), str(out), 0.5) == {"a": 3, "b": 2,
+                                                        "c": 2}
+    assert out.read_text() == ">a\nMKV\n>b\nM-V\n>c\nMK-\n"
+
+
+def test_trim_alignment_empty(tmp_path):
+    aln = tmp_path / "x.aln"
+    aln.write_text("")
+    out = tmp_path / "x.aln-cln"
+    assert trim_alignment(str(aln), str(out)) == {}
+    assert out.read_text() == ""